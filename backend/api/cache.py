@@ -0,0 +1,190 @@
+"""Кэш представлений рецептов и пользовательских множеств рецептов.
+
+Ключ представления составляется из id рецепта и трех версий: версии
+самого рецепта, версии профиля автора и версии справочников (теги,
+ингредиенты). Инвалидация сводится к замене версии, старые ключи просто
+истекают по таймауту. Избранное и список покупок пользователя хранятся
+отдельно, в виде множеств id рецептов, тоже под версионными ключами.
+"""
+from array import array
+from uuid import uuid4
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import transaction
+
+from recipes.models import Favorite, ShopingCart
+
+RECIPE_KEY = 'recipe:{pk}:{recipe}:{author}:{catalog}'
+RECIPE_VERSION_KEY = 'recipe-version:{}'
+AUTHOR_VERSION_KEY = 'author-version:{}'
+CATALOG_VERSION_KEY = 'recipe-catalog-version'
+CATALOG_MODEL_VERSION_KEY = 'catalog-version:{}'
+HITS_KEY = 'recipe-cache-hits'
+MISSES_KEY = 'recipe-cache-misses'
+USER_RECIPES_KEY = 'user-recipes:{model}:{user}:{version}'
+USER_RECIPES_VERSION_KEY = 'user-recipes-version:{model}:{user}'
+USER_RECIPE_MODELS = {
+    'is_favorited': Favorite,
+    'is_in_shopping_cart': ShopingCart,
+}
+
+
+def new_version():
+    return uuid4().hex
+
+
+def change_versions(*keys):
+    """Меняет версии после фиксации транзакции.
+
+    Если сменить версию раньше, параллельный запрос может прочитать
+    еще не зафиксированные старые строки и сохранить их под новым ключом.
+    """
+    transaction.on_commit(
+        lambda: cache.set_many(dict.fromkeys(keys, new_version()), None))
+
+
+def invalidate_recipe(pk):
+    change_versions(RECIPE_VERSION_KEY.format(pk))
+
+
+def invalidate_author(pk):
+    change_versions(AUTHOR_VERSION_KEY.format(pk))
+
+
+def catalog_version_key(model):
+    return CATALOG_MODEL_VERSION_KEY.format(model._meta.model_name)
+
+
+def invalidate_catalog(model):
+    """Меняет версию справочника и общую версию справочников."""
+    change_versions(CATALOG_VERSION_KEY, catalog_version_key(model))
+
+
+def get_versions(version_keys):
+    """Возвращает версии по ключам, заводя отсутствующие.
+
+    Пропавшую версию нельзя считать нулевой: иначе снова станет
+    актуальным давно устаревший ключ представления.
+    """
+    versions = cache.get_many(version_keys)
+    missing = {
+        key: new_version() for key in version_keys if key not in versions
+    }
+    if missing:
+        cache.set_many(missing, None)
+        versions.update(missing)
+    return versions
+
+
+def get_recipe_representations(recipes):
+    """Возвращает найденные в кэше представления и ключи всех рецептов."""
+    version_keys = {
+        recipe.pk: (
+            RECIPE_VERSION_KEY.format(recipe.pk),
+            AUTHOR_VERSION_KEY.format(recipe.author_id),
+        )
+        for recipe in recipes
+    }
+    versions = get_versions(
+        {key for keys in version_keys.values() for key in keys}
+        | {CATALOG_VERSION_KEY}
+    )
+    keys = {
+        pk: RECIPE_KEY.format(
+            pk=pk,
+            recipe=versions[recipe_key],
+            author=versions[author_key],
+            catalog=versions[CATALOG_VERSION_KEY],
+        )
+        for pk, (recipe_key, author_key) in version_keys.items()
+    }
+    found = cache.get_many(keys.values())
+    cached = {pk: found[key] for pk, key in keys.items() if key in found}
+    count_hits(len(cached), len(keys) - len(cached))
+    return cached, keys
+
+
+def set_recipe_representations(representations):
+    """Сохраняет представления, переданные словарем ключ: данные."""
+    cache.set_many(representations, settings.RECIPE_CACHE_TIMEOUT)
+
+
+def incr_counter(key, delta):
+    if not delta:
+        return
+    try:
+        cache.incr(key, delta)
+    except ValueError:
+        if not cache.add(key, delta, None):
+            cache.incr(key, delta)
+
+
+def count_hits(hits, misses):
+    incr_counter(HITS_KEY, hits)
+    incr_counter(MISSES_KEY, misses)
+
+
+def get_cache_stats():
+    """Возвращает число попаданий, промахов и долю попаданий."""
+    stats = cache.get_many((HITS_KEY, MISSES_KEY))
+    hits = stats.get(HITS_KEY, 0)
+    misses = stats.get(MISSES_KEY, 0)
+    total = hits + misses
+    return {
+        'hits': hits,
+        'misses': misses,
+        'hit_rate': hits / total if total else 0.0,
+    }
+
+
+def user_recipes_version_key(model, user_id):
+    return USER_RECIPES_VERSION_KEY.format(
+        model=model._meta.model_name, user=user_id)
+
+
+def get_user_recipe_ids(user):
+    """Возвращает id рецептов в избранном и в списке покупок.
+
+    Множества хранятся в кэше упакованными массивами целых чисел
+    и строятся заново одним запросом после смены версии.
+    """
+    if not user.is_authenticated:
+        return {field: frozenset() for field in USER_RECIPE_MODELS}
+    version_keys = {
+        field: user_recipes_version_key(model, user.pk)
+        for field, model in USER_RECIPE_MODELS.items()
+    }
+    versions = get_versions(set(version_keys.values()))
+    keys = {
+        field: USER_RECIPES_KEY.format(
+            model=USER_RECIPE_MODELS[field]._meta.model_name,
+            user=user.pk,
+            version=versions[key],
+        )
+        for field, key in version_keys.items()
+    }
+    packed = cache.get_many(keys.values())
+    recipe_ids = {}
+    for field, key in keys.items():
+        if key not in packed:
+            packed[key] = array('q', sorted(
+                USER_RECIPE_MODELS[field].objects.filter(
+                    user=user).values_list('recipe_id', flat=True)
+            )).tobytes()
+            cache.set(key, packed[key], settings.RECIPE_CACHE_TIMEOUT)
+        ids = array('q')
+        ids.frombytes(packed[key])
+        recipe_ids[field] = frozenset(ids)
+    return recipe_ids
+
+
+def forget_user_recipe_ids(model, user_ids):
+    """Меняет версии множеств пользователей после фиксации транзакции.
+
+    Удалять сами множества нельзя: запрос, прочитавший базу до фиксации,
+    сохранил бы старое множество уже после удаления.
+    """
+    keys = [user_recipes_version_key(model, user_id) for user_id in user_ids]
+    if keys:
+        change_versions(*keys)
@@ -0,0 +1,97 @@
+"""Справочники тегов и ингредиентов в памяти процесса.
+
+Каждый справочник перестраивается одним запросом, как только в кэше
+меняется его версия, то есть после любой записи в таблицу.
+"""
+import gzip
+from hashlib import sha256
+
+import brotli
+from django.utils.cache import quote_etag
+from rest_framework.renderers import JSONRenderer
+
+from recipes.models import Ingredient, Tag
+from .cache import catalog_version_key, get_versions
+
+
+class CatalogMap:
+    """Данные справочника, построенные функцией build по queryset."""
+
+    def __init__(self, model, build):
+        self.model = model
+        self.build = build
+        self.version = None
+        self.data = None
+
+    def get(self):
+        key = catalog_version_key(self.model)
+        version = get_versions({key})[key]
+        if version != self.version:
+            self.data = self.build(self.model.objects.all())
+            self.version = version
+        return self.data
+
+
+def id_set(queryset):
+    return frozenset(queryset.values_list('id', flat=True))
+
+
+tag_ids_by_slug = CatalogMap(
+    Tag, lambda queryset: dict(queryset.values_list('slug', 'id')))
+tag_ids = CatalogMap(Tag, id_set)
+ingredient_ids = CatalogMap(Ingredient, id_set)
+
+
+def all_exist(catalog, ids):
+    """Проверяет, что все id есть в справочнике.
+
+    Id, которых нет в копии процесса, проверяются одним COUNT: запись
+    могла появиться раньше, чем процесс увидел новую версию.
+    """
+    missing = set(ids) - catalog.get()
+    return not missing or catalog.model.objects.filter(
+        pk__in=missing).count() == len(missing)
+
+
+class CatalogPayload:
+    """Тело ответа со всем справочником, сжатое заранее.
+
+    Для каждой кодировки хранятся готовые байты и свой строгий ETag.
+    """
+
+    def __init__(self, content):
+        self.content = {
+            'br': brotli.compress(content),
+            'gzip': gzip.compress(content, compresslevel=9),
+            'identity': content,
+        }
+        digest = sha256(content).hexdigest()[:32]
+        self.etags = {
+            encoding: quote_etag(f'{digest}-{encoding}')
+            for encoding in self.content
+        }
+
+    def choose_encoding(self, accept_encoding):
+        """Выбирает кодировку по заголовку Accept-Encoding."""
+        accepted = {}
+        for item in accept_encoding.split(','):
+            coding, _, params = item.strip().partition(';')
+            quality = 1.0
+            if params.strip().startswith('q='):
+                try:
+                    quality = float(params.strip()[2:])
+                except ValueError:
+                    quality = 0.0
+            accepted[coding.strip().lower()] = quality
+        for encoding in self.content:
+            if accepted.get(encoding, accepted.get('*', 0)) > 0:
+                return encoding
+        return 'identity'
+
+
+def catalog_payload(serializer_class):
+    """Строит функцию сборки CatalogPayload для CatalogMap."""
+    def build(queryset):
+        return CatalogPayload(JSONRenderer().render(
+            serializer_class(queryset, many=True).data))
+    return build
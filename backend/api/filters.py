@@ -1,27 +1,90 @@
+from django import forms
 from django_filters.rest_framework import (
     FilterSet,
-    AllValuesMultipleFilter,
     BooleanFilter,
-    CharFilter
+    CharFilter,
+    ChoiceFilter,
+    Filter,
 )
 from django.contrib.auth import get_user_model
+from django.db.models import Exists, OuterRef
 
 from recipes.models import Recipe, Ingredient
+from .cache import get_user_recipe_ids
+from .catalog import tag_ids_by_slug
+from .search import search_recipes
 
 User = get_user_model()
 
 
+class SlugListField(forms.Field):
+    """Список слагов из повторяющегося параметра запроса."""
+
+    widget = forms.SelectMultiple
+
+    def to_python(self, value):
+        return [slug for slug in value or () if slug]
+
+
+class TagSlugsFilter(Filter):
+    """Фильтр по слагам тегов без запроса вариантов к базе."""
+
+    field_class = SlugListField
+
+
 class RecipeFilter(FilterSet):
-    tags = AllValuesMultipleFilter(field_name='tags__slug')
+    tags = TagSlugsFilter(method='filter_tags')
+    tags_match = ChoiceFilter(
+        choices=(('any', 'Любой из тегов'), ('all', 'Все теги')),
+        method='skip',
+    )
     is_favorited = BooleanFilter(method='enum_to_bool')
     is_in_shopping_cart = BooleanFilter(method='enum_to_bool')
+    search = CharFilter(method='filter_search')
+
+    def skip(self, queryset, name, value):
+        return queryset
+
+    def filter_tags(self, queryset, name, slugs):
+        """Отбирает рецепты с любым (или со всеми) из указанных тегов.
+
+        Слаги переводятся в id по справочнику в памяти, а условие
+        строится через EXISTS по промежуточной таблице, поэтому строки
+        рецептов не дублируются.
+        """
+        if not slugs:
+            return queryset
+        tag_ids = tag_ids_by_slug.get()
+        ids = {tag_ids[slug] for slug in slugs if slug in tag_ids}
+        through = Recipe.tags.through.objects.filter(recipe=OuterRef('pk'))
+        if self.form.cleaned_data.get('tags_match') == 'all':
+            if len(ids) < len(set(slugs)):
+                return queryset.none()
+            for tag_id in ids:
+                queryset = queryset.filter(
+                    Exists(through.filter(tag_id=tag_id)))
+            return queryset
+        if not ids:
+            return queryset.none()
+        return queryset.filter(Exists(through.filter(tag_id__in=ids)))
+
+    def filter_search(self, queryset, name, text):
+        """Полнотекстовый поиск; результаты сортируются по релевантности.
+
+        В курсорном режиме пагинации порядок задает курсор.
+        """
+        text = text.strip()
+        if not text:
+            return queryset
+        return search_recipes(queryset, text)
 
     def enum_to_bool(self, queryset, name, filter_value):
         if not filter_value:
             return queryset
         if not self.request.user.is_authenticated:
             return Recipe.objects.none()
-        return queryset.filter(**{name: filter_value})
+        return queryset.filter(
+            id__in=get_user_recipe_ids(self.request.user)[name])
 
     class Meta:
         model = Recipe
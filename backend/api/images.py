@@ -0,0 +1,133 @@
+"""Обработка изображений рецептов вне запроса.
+
+После фиксации транзакции оригинал передается в пул процессов, который
+строит уменьшенные копии без метаданных (recipes.images). Готовые файлы
+сохраняются в хранилище изображения, их имена записываются
+в Recipe.image_variants вместе с именем оригинала: пока оно не совпадает
+с текущим изображением, клиенты получают ссылку на оригинал.
+"""
+import logging
+import multiprocessing
+import os
+import threading
+from concurrent.futures import ProcessPoolExecutor
+from functools import partial
+
+from django.conf import settings
+from django.core.files.base import ContentFile
+from django.db import connection, transaction
+from django.utils import timezone
+
+from recipes.images import FORMATS, VARIANTS, render_variants
+from recipes.models import Recipe
+from .cache import invalidate_recipe
+
+logger = logging.getLogger(__name__)
+
+
+def variant_name(source, variant, file_format):
+    stem = os.path.splitext(os.path.basename(source))[0]
+    return f'recipes/variants/{stem}_{variant}.{file_format}'
+
+
+def needs_processing(recipe):
+    return bool(recipe.image) and (
+        recipe.image_variants.get('source') != recipe.image.name)
+
+
+def image_urls(recipe):
+    """Ссылки на копии изображения, до обработки — на оригинал."""
+    if not recipe.image:
+        return None
+    storage = recipe.image.storage
+    variants = recipe.image_variants
+    if needs_processing(recipe):
+        url = recipe.image.url
+        return {
+            variant: {file_format: url for file_format in FORMATS}
+            for variant in VARIANTS
+        }
+    return {
+        variant: {
+            file_format: storage.url(variants[variant][file_format])
+            for file_format in FORMATS
+        }
+        for variant in VARIANTS
+    }
+
+
+def store_variants(pk, source, rendered):
+    """Сохраняет копии и привязывает их к рецепту, если оригинал тот же.
+
+    Копии замененного изображения не удаляются: файл может быть общим
+    с другим рецептом, ненужные файлы удаляет команда gc_images.
+    """
+    storage = Recipe._meta.get_field('image').storage
+    variants = {'source': source}
+    for variant, files in rendered.items():
+        variants[variant] = {
+            file_format: storage.save(
+                variant_name(source, variant, file_format),
+                ContentFile(content),
+            )
+            for file_format, content in files.items()
+        }
+    updated = Recipe.objects.filter(pk=pk, image=source).update(
+        image_variants=variants, updated=timezone.now())
+    if updated:
+        invalidate_recipe(pk)
+    return bool(updated)
+
+
+def read_source(source):
+    storage = Recipe._meta.get_field('image').storage
+    with storage.open(source, 'rb') as image_file:
+        return image_file.read()
+
+
+def process_image(pk, source):
+    """Обрабатывает изображение в текущем процессе."""
+    return store_variants(pk, source, render_variants(read_source(source)))
+
+
+class ImagePipeline:
+    """Очередь обработки изображений воркера на пуле процессов."""
+
+    def __init__(self, workers):
+        self.workers = workers
+        self.lock = threading.Lock()
+        self.executor = None
+
+    def get_executor(self):
+        with self.lock:
+            if self.executor is None:
+                self.executor = ProcessPoolExecutor(
+                    max_workers=self.workers,
+                    mp_context=multiprocessing.get_context('spawn'),
+                )
+            return self.executor
+
+    def schedule(self, recipe):
+        """Ставит изображение рецепта в очередь после фиксации транзакции."""
+        transaction.on_commit(
+            partial(self.submit, recipe.pk, recipe.image.name))
+
+    def submit(self, pk, source):
+        if not self.workers:
+            process_image(pk, source)
+            return
+        future = self.get_executor().submit(
+            render_variants, read_source(source))
+        future.add_done_callback(partial(self.finish, pk, source))
+
+    def finish(self, pk, source, future):
+        """Вызывается в служебном потоке пула со своим соединением."""
+        try:
+            store_variants(pk, source, future.result())
+        except Exception:
+            logger.exception('Не удалось обработать изображение %s', source)
+        finally:
+            connection.close()
+
+
+image_pipeline = ImagePipeline(settings.IMAGE_PROCESSING_WORKERS)
@@ -0,0 +1,211 @@
+"""Индекс ингредиентов для автодополнения.
+
+Справочник хранится в файле, отсортированном по названию, приведенному
+к нижнему регистру (с заменой «ё» на «е»). Файл отображается в память
+через mmap, поэтому одну копию данных делят все воркеры gunicorn.
+Имя файла включает имя базы данных, а заголовок — версию справочника
+ингредиентов из кэша, по которой файл и был построен. Формат файла:
+
+    заголовок: MAGIC, число записей n (uint32), версия (32 байта);
+    смещения: n + 1 чисел uint32 от начала блока записей;
+    записи: ключ \\0 id \\0 название \\0 единица измерения \\n.
+
+Воркер, обработавший запись в таблицу ингредиентов, перестраивает файл
+и атомарно подменяет его, остальные замечают подмену по os.stat. Файл
+с другой версией справочника перестраивается при первом поиске, поэтому
+процессы на других хостах и изменения без сигналов (load_data) тоже
+приводят к перестройке.
+"""
+import mmap
+import os
+import re
+import struct
+import threading
+from array import array
+
+from django.conf import settings
+from django.db import connection, transaction
+
+from recipes.models import Ingredient
+from .cache import catalog_version_key, get_versions
+
+MAGIC = b'FGINGIX2'
+VERSION_SIZE = 32
+HEADER = struct.Struct(f'<{len(MAGIC)}sI{VERSION_SIZE}s')
+SEPARATOR = b'\0'
+
+
+def fold(text):
+    """Приводит строку к ключу поиска без учета регистра."""
+    return text.strip().casefold().replace('ё', 'е')
+
+
+def file_signature(stat):
+    return stat.st_ino, stat.st_mtime_ns, stat.st_size
+
+
+def catalog_version():
+    key = catalog_version_key(Ingredient)
+    return get_versions({key})[key].encode()[:VERSION_SIZE]
+
+
+def index_path(base):
+    """Путь к файлу индекса текущей базы данных."""
+    name = os.path.basename(str(connection.settings_dict['NAME']))
+    return '.'.join((base, re.sub(r'[^\w.-]', '_', name)))
+
+
+def build_index(path, version):
+    """Записывает файл индекса по текущему содержимому таблицы.
+
+    version берется до чтения таблицы: изменение, зафиксированное во
+    время построения, сменит версию, и файл построится еще раз.
+    """
+    rows = sorted(
+        (fold(name), unit, pk, name)
+        for pk, name, unit in Ingredient.objects.values_list(
+            'id', 'name', 'measurement_unit')
+    )
+    offsets = array('I', [0])
+    records = bytearray()
+    for key, unit, pk, name in rows:
+        records += SEPARATOR.join(
+            (key.encode(), str(pk).encode(), name.encode(), unit.encode())
+        ) + b'\n'
+        offsets.append(len(records))
+    temp_path = f'{path}.{os.getpid()}.tmp'
+    with open(temp_path, 'wb') as index_file:
+        index_file.write(HEADER.pack(MAGIC, len(rows), version))
+        index_file.write(offsets.tobytes())
+        index_file.write(records)
+    os.replace(temp_path, path)
+
+
+class IndexFile:
+    """Отображенный в память файл индекса."""
+
+    def __init__(self, path):
+        with open(path, 'rb') as index_file:
+            self.signature = file_signature(os.fstat(index_file.fileno()))
+            self.buffer = mmap.mmap(
+                index_file.fileno(), 0, access=mmap.ACCESS_READ)
+        magic, self.count, self.version = HEADER.unpack_from(self.buffer)
+        if magic != MAGIC:
+            raise ValueError(f'{path} не является индексом ингредиентов.')
+        self.start = HEADER.size + 4 * (self.count + 1)
+        self.offsets = memoryview(
+            self.buffer)[HEADER.size:self.start].cast('I')
+
+    def key(self, index):
+        begin = self.start + self.offsets[index]
+        return self.buffer[begin:self.buffer.find(SEPARATOR, begin)]
+
+    def record(self, index):
+        begin = self.start + self.offsets[index]
+        end = self.start + self.offsets[index + 1] - 1
+        _, pk, name, unit = self.buffer[begin:end].split(SEPARATOR)
+        return {
+            'id': int(pk),
+            'name': name.decode(),
+            'measurement_unit': unit.decode(),
+        }
+
+    def lower_bound(self, needle):
+        low, high = 0, self.count
+        while low < high:
+            middle = (low + high) // 2
+            if self.key(middle) < needle:
+                low = middle + 1
+            else:
+                high = middle
+        return low
+
+    def record_at(self, position):
+        """Номер записи, в которую попадает позиция в блоке записей."""
+        low, high = 0, self.count
+        while high - low > 1:
+            middle = (low + high) // 2
+            if self.offsets[middle] <= position:
+                low = middle
+            else:
+                high = middle
+        return low
+
+    def search(self, needle, limit):
+        found = []
+        index = self.lower_bound(needle)
+        while (index < self.count and len(found) < limit
+               and self.key(index).startswith(needle)):
+            found.append(index)
+            index += 1
+        position = self.buffer.find(needle, self.start)
+        while position != -1 and len(found) < limit:
+            index = self.record_at(position - self.start)
+            key_end = self.buffer.find(
+                SEPARATOR, self.start + self.offsets[index])
+            if (position + len(needle) <= key_end
+                    and not self.key(index).startswith(needle)):
+                found.append(index)
+            position = self.buffer.find(
+                needle, self.start + self.offsets[index + 1])
+        return [self.record(index) for index in found]
+
+
+class IngredientIndex:
+    """Поиск ингредиентов: сначала по префиксу, затем по подстроке."""
+
+    def __init__(self, path):
+        self.path = path
+        self.lock = threading.Lock()
+        self.file = None
+        self.pending = threading.local()
+
+    def open(self, path):
+        """Открывает файл заново, если его подменили."""
+        try:
+            signature = file_signature(os.stat(path))
+        except FileNotFoundError:
+            return None
+        if (self.file is None or self.file.path != path
+                or self.file.signature != signature):
+            self.file = IndexFile(path)
+            self.file.path = path
+        return self.file
+
+    def get_file(self):
+        """Возвращает файл индекса текущей версии справочника."""
+        version = catalog_version()
+        path = index_path(self.path)
+        with self.lock:
+            index_file = self.open(path)
+            if index_file is None or index_file.version != version:
+                build_index(path, version)
+                index_file = self.open(path)
+            return index_file
+
+    def search(self, text, limit):
+        """Возвращает до limit ингредиентов, совпавших с текстом."""
+        needle = fold(text).encode()
+        if not needle or SEPARATOR in needle:
+            return []
+        return self.get_file().search(needle, limit)
+
+    def schedule_rebuild(self):
+        """Перестраивает индекс один раз после фиксации транзакции.
+
+        После отката флаг остается поднятым, и следующая запись
+        перестройку не назначит. Это безопасно: файл устаревшей версии
+        перестроит первый поиск.
+        """
+        if getattr(self.pending, 'rebuild', False):
+            return
+        self.pending.rebuild = True
+        transaction.on_commit(self.rebuild)
+
+    def rebuild(self):
+        self.pending.rebuild = False
+        with self.lock:
+            build_index(index_path(self.path), catalog_version())
+
+
+ingredient_index = IngredientIndex(settings.INGREDIENT_INDEX_PATH)
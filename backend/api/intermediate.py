@@ -1,45 +1,220 @@
+from django.contrib.auth import get_user_model
+from django.db import connection, transaction
+from rest_framework.exceptions import NotFound
 from rest_framework.response import Response
 from rest_framework import status
-from rest_framework.serializers import ValidationError
+from rest_framework.serializers import (
+    PrimaryKeyRelatedField,
+    ValidationError,
+)
+from rest_framework.settings import api_settings
 
 from users.models import Follow
-from recipes.models import Favorite, ShopingCart
+from recipes.counters import change_favorites_count, change_followers_count
+from recipes.feed import follow_authors, unfollow_authors
+from recipes.models import Favorite, Recipe, ShopingCart
+from recipes.shopping_list import add_recipes, remove_recipes
+from .cache import forget_user_recipe_ids
 from .serializers import (
+    BulkIdsSerializer,
     FavoriteSerializer,
     ShopingCartSerializer,
     SubscribeSerializer,
 )
 
+User = get_user_model()
+
+BULK_TARGETS = {
+    Favorite: (Recipe, 'recipe_id'),
+    ShopingCart: (Recipe, 'recipe_id'),
+    Follow: (User, 'following_id'),
+}
+LINKS = {
+    Favorite: (FavoriteSerializer, 'recipe'),
+    ShopingCart: (ShopingCartSerializer, 'recipe'),
+    Follow: (SubscribeSerializer, 'following'),
+}
+EXISTS_MESSAGES = {
+    Favorite: 'Рецепт уже в избранном',
+    ShopingCart: 'Рецепт уже в списке покупок',
+    Follow: 'Нельзя дважды подписаться на одного блогера!',
+}
+MISSING_MESSAGES = {
+    Favorite: 'Рецепт отсутствует в избранном!',
+    ShopingCart: 'Рецепт отсутствует в списке покупок!',
+    Follow: 'У вас нет подписки на этого блогера!',
+}
+SELF_FOLLOW_MESSAGE = 'Нельзя подписаться на себя!'
+
+
+def intermediate_changed(user_id, model, ids, added):
+    """Обновляет данные, производные от связей пользователя.
+
+    Вызывается в той же транзакции, что и изменение связей.
+    """
+    delta = 1 if added else -1
+    if model is Follow:
+        change_followers_count(ids, delta)
+        if added:
+            follow_authors(user_id, ids)
+        else:
+            unfollow_authors(user_id, ids)
+        return
+    forget_user_recipe_ids(model, (user_id,))
+    if model is Favorite:
+        change_favorites_count(ids, delta)
+    if model is ShopingCart:
+        if added:
+            add_recipes(user_id, ids)
+        else:
+            remove_recipes(user_id, ids)
+
+
+def parse_pk(pk):
+    try:
+        return int(pk)
+    except (TypeError, ValueError):
+        return None
+
+
+def target_exists(model, pk):
+    target, _ = BULK_TARGETS[model]
+    return pk is not None and target.objects.filter(pk=pk).exists()
+
+
+def insert_links(model, user_id, pks):
+    """Добавляет связи с существующими объектами из pks.
+
+    Уникальность проверяет сама база (ON CONFLICT DO NOTHING), поэтому
+    параллельные запросы не приводят к IntegrityError. Возвращает id
+    объектов, связи с которыми действительно добавлены.
+    """
+    if not pks:
+        return set()
+    target, field = BULK_TARGETS[model]
+    quote = connection.ops.quote_name
+    opts = model._meta
+    column = quote(opts.get_field(field).column)
+    target_pk = quote(target._meta.pk.column)
+    sql = (
+        f'INSERT INTO {quote(opts.db_table)} '
+        f'({quote(opts.get_field("user").column)}, {column}) '
+        f'SELECT %s, {target_pk} FROM {quote(target._meta.db_table)} '
+        f'WHERE {target_pk} IN ({", ".join(["%s"] * len(pks))}) '
+        f'ON CONFLICT DO NOTHING RETURNING {column}'
+    )
+    with connection.cursor() as cursor:
+        cursor.execute(sql, (user_id, *pks))
+        return {pk for pk, in cursor.fetchall()}
+
+
+def delete_links(model, user_id, pks):
+    """Удаляет связи пользователя с объектами из pks.
+
+    Запрос не отправляет сигналы моделей, счетчики обновляет
+    intermediate_changed. Возвращает id объектов, связи с которыми
+    были удалены.
+    """
+    if not pks:
+        return set()
+    _, field = BULK_TARGETS[model]
+    quote = connection.ops.quote_name
+    opts = model._meta
+    column = quote(opts.get_field(field).column)
+    sql = (
+        f'DELETE FROM {quote(opts.db_table)} '
+        f'WHERE {quote(opts.get_field("user").column)} = %s '
+        f'AND {column} IN ({", ".join(["%s"] * len(pks))}) '
+        f'RETURNING {column}'
+    )
+    with connection.cursor() as cursor:
+        cursor.execute(sql, (user_id, *pks))
+        return {pk for pk, in cursor.fetchall()}
+
 
 def del_intermediate_obj(request, pk, model):
-    args_for_obj = {
-        Favorite: {'user': request.user, 'recipe': pk},
-        ShopingCart: {'user': request.user, 'recipe': pk},
-        Follow: {'user': request.user, 'following': pk},
-    }
-    messages = {
-        Favorite: 'Рецепт отсутствует в избранном!',
-        ShopingCart: 'Рецепт отсутствует в списке покупок!',
-        Follow: 'У вас нет подписки на этого блогера!',
-    }
-    obj = model.objects.filter(**(args_for_obj.get(model)))
-    if len(obj) == 0:
-        raise ValidationError(messages.get(model))
-    obj.delete()
-    return Response(status=status.HTTP_204_NO_CONTENT)
+    """Удаляет связь одним DELETE, причину неудачи выясняет после."""
+    pk = parse_pk(pk)
+    with transaction.atomic():
+        deleted = pk is not None and delete_links(
+            model, request.user.pk, (pk,))
+        if deleted:
+            intermediate_changed(request.user.pk, model, (pk,), added=False)
+    if deleted:
+        return Response(status=status.HTTP_204_NO_CONTENT)
+    if not target_exists(model, pk):
+        raise NotFound
+    raise ValidationError(MISSING_MESSAGES[model])
 
 
 def add_intermediate_obj(request, pk, model):
-    map = {Favorite: (FavoriteSerializer, 'recipe'),
-           ShopingCart: (ShopingCartSerializer, 'recipe'),
-           Follow: (SubscribeSerializer, 'following'),
-           }
-    data = {'user': request.user.pk, map.get(model)[1]: pk, }
-    context = {'request': request}
-    serializer = map.get(model)[0](data=data, context=context)
-    serializer.is_valid(raise_exception=True)
-    serializer.save()
+    """Добавляет связь одним INSERT, причину неудачи выясняет после."""
+    serializer_class, field = LINKS[model]
+    target, _ = BULK_TARGETS[model]
+    user_id = request.user.pk
+    parsed_pk = parse_pk(pk)
+    if model is Follow and parsed_pk == user_id:
+        raise ValidationError({field: [SELF_FOLLOW_MESSAGE]})
+    with transaction.atomic():
+        added = parsed_pk is not None and insert_links(
+            model, user_id, (parsed_pk,))
+        if added:
+            intermediate_changed(user_id, model, (parsed_pk,), added=True)
+    if not added:
+        if target_exists(model, parsed_pk):
+            raise ValidationError(
+                {api_settings.NON_FIELD_ERRORS_KEY: [EXISTS_MESSAGES[model]]})
+        if model is Follow:
+            raise NotFound
+        relation = PrimaryKeyRelatedField(queryset=target.objects.all())
+        try:
+            relation.to_internal_value(pk)
+        except ValidationError as error:
+            raise ValidationError({field: error.detail})
+    instance = model(user=request.user, **{field: target.objects.get(
+        pk=parsed_pk)})
     return Response(
-        serializer.data,
+        serializer_class(instance, context={'request': request}).data,
         status=status.HTTP_201_CREATED
     )
+
+
+def bulk_intermediate_obj(request, model):
+    """Добавляет (POST) или удаляет (DELETE) связи с объектами из ids.
+
+    Весь пакет обрабатывается в одной транзакции одним INSERT или DELETE
+    с RETURNING: производные данные обновляются только для строк,
+    которые запрос действительно изменил.
+    Для каждого id возвращается статус: added, removed, exists,
+    missing (связи не было), not_found или self (подписка на себя).
+    """
+    serializer = BulkIdsSerializer(data=request.data)
+    serializer.is_valid(raise_exception=True)
+    ids = serializer.validated_data['ids']
+    target, field = BULK_TARGETS[model]
+    user_id = request.user.pk
+    with transaction.atomic():
+        if request.method == 'DELETE':
+            linked = delete_links(model, user_id, list(set(ids)))
+            found = linked | set(target.objects.filter(
+                pk__in=set(ids) - linked).values_list('pk', flat=True))
+            if linked:
+                intermediate_changed(user_id, model, linked, added=False)
+            statuses = {pk: 'removed' for pk in linked}
+            statuses.update({pk: 'missing' for pk in found - linked})
+        else:
+            candidates = set(ids)
+            if model is Follow:
+                candidates.discard(user_id)
+            added = insert_links(model, user_id, list(candidates))
+            if added:
+                intermediate_changed(user_id, model, added, added=True)
+            found = added | set(target.objects.filter(
+                pk__in=set(ids) - added).values_list('pk', flat=True))
+            statuses = {pk: 'exists' for pk in found - added}
+            if model is Follow and user_id in found:
+                statuses[user_id] = 'self'
+            statuses.update({pk: 'added' for pk in added})
+    return Response([
+        {'id': pk, 'status': statuses.get(pk, 'not_found')} for pk in ids
+    ])
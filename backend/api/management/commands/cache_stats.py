@@ -0,0 +1,14 @@
+from django.core.management.base import BaseCommand
+
+from api.cache import get_cache_stats
+
+
+class Command(BaseCommand):
+    help = 'Показывает эффективность кэша представлений рецептов.'
+
+    def handle(self, *args, **options):
+        stats = get_cache_stats()
+        self.stdout.write(
+            f'Попаданий: {stats["hits"]}, промахов: {stats["misses"]}, '
+            f'доля попаданий: {stats["hit_rate"]:.1%}'
+        )
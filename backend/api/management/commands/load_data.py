@@ -0,0 +1,164 @@
+import csv
+import io
+import json
+
+from django.core.cache import caches
+from django.core.cache.backends.locmem import LocMemCache
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, transaction
+
+from recipes.models import Ingredient
+from api.cache import invalidate_catalog
+from api.ingredient_index import ingredient_index
+
+
+def iter_json_array(file, chunk_size=64 * 1024):
+    """Возвращает элементы JSON-массива по одному, читая файл частями."""
+    decoder = json.JSONDecoder()
+    buffer = file.read(chunk_size).lstrip()
+    if not buffer.startswith('['):
+        raise CommandError('Ожидается JSON-массив.')
+    position = 1
+    eof = False
+    while True:
+        while position < len(buffer) and buffer[position] in ' \t\r\n,':
+            position += 1
+        if position < len(buffer) and buffer[position] == ']':
+            return
+        try:
+            item, position = decoder.raw_decode(buffer, position)
+        except json.JSONDecodeError:
+            if eof:
+                raise CommandError('Некорректный JSON.')
+            chunk = file.read(chunk_size)
+            eof = not chunk
+            buffer = buffer[position:] + chunk
+            position = 0
+            continue
+        yield item
+
+
+class Command(BaseCommand):
+    help = ('Загружает ингредиенты из static/data/ingredients.csv или '
+            '.json, уже существующие пропускаются.')
+    directory_path = r'static/data/'
+
+    def csv_rows(self, file):
+        """Возвращает пары (название, единица) из CSV файла."""
+        for row in csv.reader(file, delimiter=','):
+            if row:
+                yield row[0], row[1]
+
+    def json_rows(self, file):
+        """Возвращает пары (название, единица) из JSON файла."""
+        for item in iter_json_array(file):
+            yield item['name'], item['measurement_unit']
+
+    def batches(self, rows, size):
+        batch = []
+        for row in rows:
+            batch.append(row)
+            if len(batch) >= size:
+                yield batch
+                batch = []
+        if batch:
+            yield batch
+
+    def add_arguments(self, parser):
+        parser.add_argument('type_file', type=str, choices=('csv', 'json'),
+                            help='Введите тип расширения файла csv или json.'
+                                 'Например load_data csv')
+        parser.add_argument('--path',
+                            help='Путь к файлу вместо static/data/.')
+        parser.add_argument('--dry-run', action='store_true',
+                            help='Загрузить и откатить транзакцию.')
+        parser.add_argument('--batch-size', type=int, default=10000,
+                            help='Строк в одной пачке.')
+
+    def handle(self, *args, **options):
+        type_file = options['type_file']
+        path = options['path'] or (
+            f'{self.directory_path}ingredients.{type_file}')
+        postgres = connection.vendor == 'postgresql'
+        read = self.csv_rows if type_file == 'csv' else self.json_rows
+        with open(path, encoding='utf-8-sig', newline='') as file:
+            with transaction.atomic():
+                before = Ingredient.objects.count()
+                if postgres:
+                    self.create_staging()
+                load = self.copy_batch if postgres else self.insert_batch
+                total = 0
+                for batch in self.batches(read(file), options['batch_size']):
+                    load(batch)
+                    total += len(batch)
+                    self.stdout.write(f'Прочитано строк: {total}')
+                if postgres:
+                    self.merge_staging()
+                created = Ingredient.objects.count() - before
+                if options['dry_run']:
+                    transaction.set_rollback(True)
+                elif created:
+                    transaction.on_commit(self.catalog_loaded)
+        self.stdout.write(self.style.SUCCESS(
+            f'{"Будет добавлено" if options["dry_run"] else "Добавлено"} '
+            f'ингредиентов: {created}, пропущено строк: {total - created}.'
+        ))
+
+    def insert_batch(self, batch):
+        Ingredient.objects.bulk_create(
+            (Ingredient(name=name, measurement_unit=unit)
+             for name, unit in batch),
+            ignore_conflicts=True,
+        )
+
+    def create_staging(self):
+        """Временная таблица для COPY.
+
+        merge_staging удаляет ее сама: ON COMMIT DROP не срабатывает,
+        если команду вызвали внутри внешней транзакции.
+        """
+        with connection.cursor() as cursor:
+            cursor.execute(
+                'CREATE TEMPORARY TABLE ingredient_staging '
+                '(name varchar(150), measurement_unit varchar(150)) '
+                'ON COMMIT DROP'
+            )
+
+    def copy_batch(self, batch):
+        buffer = io.StringIO()
+        csv.writer(buffer).writerows(batch)
+        buffer.seek(0)
+        with connection.cursor() as cursor:
+            cursor.copy_expert(
+                'COPY ingredient_staging (name, measurement_unit) '
+                'FROM STDIN WITH (FORMAT csv)',
+                buffer,
+            )
+
+    def merge_staging(self):
+        table = connection.ops.quote_name(Ingredient._meta.db_table)
+        with connection.cursor() as cursor:
+            cursor.execute('ANALYZE ingredient_staging')
+            cursor.execute(
+                f'INSERT INTO {table} (name, measurement_unit) '
+                'SELECT name, measurement_unit FROM ('
+                'SELECT name, measurement_unit FROM ingredient_staging '
+                f'EXCEPT SELECT name, measurement_unit FROM {table}'
+                ') AS new '
+                'ON CONFLICT (name, measurement_unit) DO NOTHING'
+            )
+            cursor.execute('DROP TABLE ingredient_staging')
+
+    def catalog_loaded(self):
+        """Обновляет справочник и индекс поиска.
+
+        bulk_create и COPY не отправляют сигналы, поэтому это делается
+        явно после фиксации транзакции. Новые версии справочника сервер
+        увидит только через общий кэш (memcached в docker compose).
+        """
+        invalidate_catalog(Ingredient)
+        ingredient_index.rebuild()
+        if isinstance(caches['default'], LocMemCache):
+            self.stderr.write(self.style.WARNING(
+                'Кэш хранится в памяти процесса: перезапустите сервер, '
+                'чтобы он увидел новые ингредиенты.'))
@@ -0,0 +1,318 @@
+import csv
+import io
+import json
+import multiprocessing
+import os
+from collections import Counter, defaultdict
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+
+from django.contrib.auth import get_user_model
+from django.core.files import File
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, transaction
+from django.utils import timezone
+from django.utils.dateparse import parse_datetime
+
+from recipes.counters import change_counter
+from recipes.feed import fan_out_many
+from recipes.images import render_variants
+from recipes.models import (
+    Ingredient,
+    IngredientInRecipe,
+    Recipe,
+    Tag,
+    recipe_digest,
+)
+from api.images import read_source, store_variants
+
+User = get_user_model()
+
+MAX_COOKING_TIME = 1440
+CSV_FIELDS = (
+    'author', 'name', 'text', 'cooking_time', 'image', 'tags', 'ingredients')
+
+
+class RowError(ValueError):
+    pass
+
+
+class Command(BaseCommand):
+    help = ('Загружает рецепты из JSONL или CSV. Авторы, теги '
+            'и ингредиенты должны уже существовать, рецепты, '
+            'загруженные раньше, пропускаются. Дата created из '
+            'выгрузки сохраняется.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('path', help='Файл .jsonl или .csv.')
+        parser.add_argument('--format', choices=('jsonl', 'csv'),
+                            help='Формат файла, по умолчанию по расширению.')
+        parser.add_argument('--images-dir',
+                            help='Каталог с исходными изображениями. Без '
+                                 'него image — имя файла в хранилище.')
+        parser.add_argument('--batch-size', type=int, default=1000,
+                            help='Рецептов в одной транзакции.')
+        parser.add_argument('--workers', type=int, default=0,
+                            help='Процессов для уменьшенных копий, при 0 '
+                                 'копии строит команда process_images.')
+
+    def handle(self, *args, **options):
+        path = options['path']
+        file_format = options['format'] or (
+            'csv' if path.endswith('.csv') else 'jsonl')
+        self.images_dir = options['images_dir']
+        self.storage = Recipe._meta.get_field('image').storage
+        self.load_maps()
+        self.loaded = self.skipped = self.failed = 0
+        self.executor = None
+        self.pending = set()
+        if options['workers']:
+            self.workers = options['workers']
+            self.executor = ProcessPoolExecutor(
+                max_workers=self.workers,
+                mp_context=multiprocessing.get_context('spawn'),
+            )
+        try:
+            with open(path, encoding='utf-8-sig', newline='') as file:
+                read = self.csv_rows if file_format == 'csv' else (
+                    self.jsonl_rows)
+                batch = []
+                for line, row in read(file):
+                    try:
+                        batch.append(self.resolve(row))
+                    except (RowError, KeyError, TypeError) as error:
+                        self.failed += 1
+                        self.stderr.write(f'Строка {line}: {error!r}')
+                        continue
+                    if len(batch) >= options['batch_size']:
+                        self.load_batch(batch)
+                        batch = []
+                if batch:
+                    self.load_batch(batch)
+            self.drain(len(self.pending))
+        finally:
+            if self.executor is not None:
+                self.executor.shutdown(cancel_futures=True)
+        self.stdout.write(self.style.SUCCESS(
+            f'Загружено рецептов: {self.loaded}, уже были: {self.skipped}, '
+            f'с ошибками: {self.failed}.'))
+
+    def load_maps(self):
+        """Справочники для поиска ссылок без запросов на каждую строку."""
+        self.authors = {}
+        for email, username, pk in User.objects.values_list(
+                'email', 'username', 'pk').iterator():
+            self.authors[email] = self.authors[username] = pk
+        self.tags = dict(Tag.objects.values_list('slug', 'pk'))
+        self.ingredients = {
+            (name, unit): pk for name, unit, pk in
+            Ingredient.objects.values_list(
+                'name', 'measurement_unit', 'pk').iterator()
+        }
+
+    def jsonl_rows(self, file):
+        for line, text in enumerate(file, 1):
+            if not text.strip():
+                continue
+            try:
+                row = json.loads(text)
+            except json.JSONDecodeError as error:
+                self.failed += 1
+                self.stderr.write(f'Строка {line}: {error}')
+                continue
+            if row.get('type', 'recipe') == 'recipe':
+                yield line, row
+
+    def csv_rows(self, file):
+        """Строки CSV в том же виде, что и строки JSONL.
+
+        Теги перечисляются через запятую, ингредиенты — через точку
+        с запятой в виде название:единица:количество.
+        """
+        reader = csv.DictReader(file)
+        if reader.fieldnames is None or set(CSV_FIELDS) - set(
+                reader.fieldnames):
+            raise CommandError(
+                f'Нужны столбцы: {", ".join(CSV_FIELDS)}.')
+        for line, row in enumerate(reader, 2):
+            row['tags'] = [
+                slug.strip() for slug in row['tags'].split(',')
+                if slug.strip()
+            ]
+            row['ingredients'] = [
+                dict(zip(('name', 'measurement_unit', 'amount'),
+                         item.rsplit(':', 2)))
+                for item in row['ingredients'].split(';') if item.strip()
+            ]
+            yield line, row
+
+    def resolve(self, row):
+        """Заменяет ссылки строки на id, проверяя их по справочникам."""
+        author = self.authors.get(row['author'])
+        if author is None:
+            raise RowError(f'Нет автора {row["author"]}')
+        try:
+            tags = {self.tags[slug] for slug in row['tags']}
+        except KeyError as error:
+            raise RowError(f'Нет тега {error}')
+        amounts = Counter()
+        for item in row['ingredients']:
+            key = (item['name'], item['measurement_unit'])
+            if key not in self.ingredients:
+                raise RowError(f'Нет ингредиента {key}')
+            amounts[self.ingredients[key]] += self.positive(item['amount'])
+        if not tags or not amounts or not row['image']:
+            raise RowError('Нужны теги, ингредиенты и изображение')
+        recipe = Recipe(
+            author_id=author,
+            name=row['name'],
+            text=row['text'],
+            cooking_time=self.positive(row['cooking_time']),
+            image=row['image'],
+        )
+        if len(recipe.name) > Recipe._meta.get_field('name').max_length:
+            raise RowError('Слишком длинное название')
+        if recipe.cooking_time > MAX_COOKING_TIME:
+            raise RowError('Слишком долгое время приготовления')
+        recipe.digest = recipe_digest(recipe.name, recipe.text)
+        return recipe, tags, amounts, self.created(row.get('created'))
+
+    def created(self, value):
+        """Дата создания из выгрузки, None — текущее время."""
+        if not value:
+            return None
+        try:
+            created = parse_datetime(value)
+        except ValueError:
+            created = None
+        if created is None:
+            raise RowError(f'Некорректная дата: {value!r}')
+        if timezone.is_naive(created):
+            created = timezone.make_aware(created)
+        return created
+
+    def positive(self, value):
+        try:
+            number = int(value)
+        except (TypeError, ValueError):
+            number = 0
+        if number < 1:
+            raise RowError(f'Ожидается целое больше нуля: {value!r}')
+        return number
+
+    def load_batch(self, batch):
+        """Создает рецепты пачки и их связи в одной транзакции."""
+        new = {}
+        for row in batch:
+            recipe = row[0]
+            new.setdefault((recipe.author_id, recipe.digest), row)
+        existing = set(Recipe.objects.filter(
+            author_id__in={author for author, _ in new},
+            digest__in={digest for _, digest in new},
+        ).values_list('author_id', 'digest'))
+        for key in existing & new.keys():
+            del new[key]
+        self.skipped += len(batch) - len(new)
+        for key, (recipe, *_) in list(new.items()):
+            try:
+                recipe.image = self.store_image(recipe.image.name)
+            except (OSError, RowError) as error:
+                self.failed += 1
+                self.stderr.write(f'Рецепт {recipe.name}: {error}')
+                del new[key]
+        if not new:
+            return
+        recipes = [recipe for recipe, *_ in new.values()]
+        with transaction.atomic():
+            Recipe.objects.bulk_create(recipes)
+            if not connection.features.can_return_rows_from_bulk_insert:
+                ids = {
+                    (author, digest): pk
+                    for author, digest, pk in Recipe.objects.filter(
+                        author_id__in={author for author, _ in new},
+                        digest__in={recipe.digest for recipe in recipes},
+                    ).values_list('author_id', 'digest', 'pk')
+                }
+                for recipe in recipes:
+                    recipe.pk = ids[recipe.author_id, recipe.digest]
+            dated = []
+            for recipe, _, _, created in new.values():
+                if created is not None:
+                    recipe.created = created
+                    dated.append(recipe)
+            if dated:
+                # created заполняется auto_now_add при вставке.
+                Recipe.objects.bulk_update(dated, ('created',), 1000)
+            self.insert_rows(Recipe.tags.through, ('recipe', 'tag'), (
+                (recipe.pk, tag)
+                for recipe, tags, _, _ in new.values() for tag in tags))
+            self.insert_rows(
+                IngredientInRecipe, ('recipe', 'ingredient', 'amount'), (
+                    (recipe.pk, pk, amount)
+                    for recipe, _, amounts, _ in new.values()
+                    for pk, amount in amounts.items()))
+            by_count = defaultdict(list)
+            for author, count in Counter(
+                    recipe.author_id for recipe in recipes).items():
+                by_count[count].append(author)
+            for count, authors in by_count.items():
+                change_counter(User, 'recipes_count', authors, count)
+            fan_out_many(recipes)
+        self.loaded += len(recipes)
+        self.stdout.write(f'Загружено рецептов: {self.loaded}')
+        if self.executor is not None:
+            for recipe in recipes:
+                self.submit(recipe.pk, recipe.image.name)
+
+    def insert_rows(self, model, names, rows):
+        """Вставляет строки связей: COPY на PostgreSQL, иначе bulk_create."""
+        fields = [model._meta.get_field(name) for name in names]
+        if connection.vendor != 'postgresql':
+            model.objects.bulk_create(
+                (model(**{field.attname: value
+                          for field, value in zip(fields, row)})
+                 for row in rows),
+                batch_size=5000,
+            )
+            return
+        buffer = io.StringIO()
+        csv.writer(buffer).writerows(rows)
+        buffer.seek(0)
+        quote = connection.ops.quote_name
+        columns = ', '.join(quote(field.column) for field in fields)
+        with connection.cursor() as cursor:
+            cursor.copy_expert(
+                f'COPY {quote(model._meta.db_table)} ({columns}) '
+                'FROM STDIN WITH (FORMAT csv)',
+                buffer,
+            )
+
+    def store_image(self, name):
+        """Копирует изображение в хранилище, одинаковые файлы — один раз."""
+        if self.images_dir is None:
+            if not self.storage.exists(name):
+                raise RowError(f'Нет изображения {name} в хранилище')
+            return name
+        with open(os.path.join(self.images_dir, name), 'rb') as source:
+            return self.storage.save(
+                f'recipes/images/{os.path.basename(name)}', File(source))
+
+    def submit(self, pk, source):
+        """Ставит изображение в пул, ограничивая число задач в очереди."""
+        if len(self.pending) >= self.workers * 4:
+            self.drain(1)
+        future = self.executor.submit(render_variants, read_source(source))
+        future.recipe = (pk, source)
+        self.pending.add(future)
+
+    def drain(self, count):
+        """Сохраняет копии хотя бы count завершенных задач."""
+        while count > 0 and self.pending:
+            done, self.pending = wait(
+                self.pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                count -= 1
+                try:
+                    store_variants(*future.recipe, future.result())
+                except Exception as error:
+                    self.stderr.write(
+                        f'Изображение {future.recipe[1]}: {error}')
@@ -0,0 +1,28 @@
+from django.core.management.base import BaseCommand
+
+from recipes.models import Recipe
+from api.images import needs_processing, process_image
+
+
+class Command(BaseCommand):
+    help = 'Строит уменьшенные копии изображений рецептов.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--all', action='store_true',
+                            help='Обработать и уже обработанные рецепты.')
+
+    def handle(self, *args, **options):
+        processed = 0
+        recipes = Recipe.objects.only('id', 'image', 'image_variants')
+        for recipe in recipes.order_by('pk').iterator():
+            if not recipe.image:
+                continue
+            if options['all'] or needs_processing(recipe):
+                try:
+                    process_image(recipe.pk, recipe.image.name)
+                except (OSError, ValueError) as error:
+                    self.stderr.write(f'Рецепт id={recipe.pk}: {error}')
+                    continue
+                processed += 1
+        self.stdout.write(self.style.SUCCESS(
+            f'Обработано изображений: {processed}.'))
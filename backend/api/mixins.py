@@ -1,3 +1,15 @@
+from hashlib import md5
+
+from django.conf import settings
+from django.http import HttpResponse
+from django.utils.cache import (
+    get_conditional_response,
+    patch_cache_control,
+    patch_vary_headers,
+    quote_etag,
+)
+from django.utils.http import http_date
+from rest_framework import status
 from rest_framework.viewsets import GenericViewSet
 from rest_framework.mixins import ListModelMixin, RetrieveModelMixin
 
@@ -5,6 +17,71 @@ from .permissions import IsAuthorOrAdminOrReadOnly
 
 
 class TagIngredientMixin(RetrieveModelMixin, ListModelMixin, GenericViewSet):
+    """Справочник; полный список отдается заранее сжатым телом.
+
+    catalog — CatalogMap, строящий CatalogPayload для представления.
+    """
 
     permission_classes = (IsAuthorOrAdminOrReadOnly,)
     pagination_class = None
+    catalog = None
+
+    def list(self, request, *args, **kwargs):
+        if self.catalog is None or request.query_params:
+            return super().list(request, *args, **kwargs)
+        payload = self.catalog.get()
+        encoding = payload.choose_encoding(
+            request.META.get('HTTP_ACCEPT_ENCODING', ''))
+        etag = payload.etags[encoding]
+        response = get_conditional_response(request, etag=etag)
+        if response is None:
+            response = HttpResponse(
+                payload.content[encoding], content_type='application/json')
+            if encoding != 'identity':
+                response['Content-Encoding'] = encoding
+        response['ETag'] = etag
+        patch_cache_control(
+            response, public=True, max_age=settings.CATALOG_MAX_AGE)
+        patch_vary_headers(response, ('Accept-Encoding',))
+        return response
+
+
+class ConditionalGetMixin:
+    """Ответ 304 Not Modified на условные запросы списка и объекта.
+
+    Валидаторы считает представление в get_list_validators и
+    get_detail_validators: они возвращают части ETag и дату изменения
+    либо None, если проверку нужно пропустить. Решение принимается
+    только по ETag: дата изменения не учитывает удаления и флаги
+    пользователя, поэтому отдается лишь для информации.
+    """
+
+    def list(self, request, *args, **kwargs):
+        return self.conditional_response(
+            self.get_list_validators(), super().list,
+            request, *args, **kwargs)
+
+    def retrieve(self, request, *args, **kwargs):
+        return self.conditional_response(
+            self.get_detail_validators(), super().retrieve,
+            request, *args, **kwargs)
+
+    def conditional_response(self, validators, view, request, *args,
+                             **kwargs):
+        if validators is None:
+            return view(request, *args, **kwargs)
+        parts, last_modified = validators
+        parts = (*parts, request.get_full_path())
+        etag = quote_etag(
+            md5('|'.join(map(str, parts)).encode()).hexdigest())
+        response = get_conditional_response(request, etag=etag)
+        if response is None:
+            response = view(request, *args, **kwargs)
+            if response.status_code != status.HTTP_200_OK:
+                return response
+            if last_modified is not None:
+                response['Last-Modified'] = http_date(
+                    last_modified.timestamp())
+        response['ETag'] = etag
+        patch_vary_headers(response, ('Authorization',))
+        return response
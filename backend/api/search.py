@@ -0,0 +1,59 @@
+"""Полнотекстовый поиск рецептов по названию и описанию.
+
+В PostgreSQL поиск идет по хранимому tsvector с GIN-индексом, который
+поддерживает триггер из миграции recipes.0010. На остальных СУБД
+(например, SQLite в тестах) используется простой поиск по подстроке
+без учета регистра: LIKE в SQLite не сравнивает кириллицу без учета
+регистра, поэтому обе стороны приводятся функцией CASEFOLD.
+"""
+from django.conf import settings
+from django.contrib.postgres.search import SearchQuery, SearchRank
+from django.db import connection
+from django.db.models import (
+    Case,
+    F,
+    Func,
+    IntegerField,
+    Q,
+    TextField,
+    Value,
+    When,
+)
+
+
+class Casefold(Func):
+    function = 'CASEFOLD'
+    output_field = TextField()
+
+
+def casefold(value):
+    return None if value is None else value.casefold()
+
+
+def register_casefold():
+    """Регистрирует CASEFOLD в текущем соединении SQLite."""
+    connection.ensure_connection()
+    connection.connection.create_function(
+        'CASEFOLD', 1, casefold, deterministic=True)
+
+
+def search_recipes(queryset, text):
+    """Отбирает рецепты по запросу и сортирует их по релевантности."""
+    if connection.vendor == 'postgresql':
+        query = SearchQuery(
+            text, config=settings.SEARCH_CONFIG, search_type='websearch')
+        queryset = queryset.filter(search_vector=query).annotate(
+            search_rank=SearchRank(F('search_vector'), query))
+    else:
+        register_casefold()
+        queryset = queryset.annotate(
+            folded_name=Casefold('name'), folded_text=Casefold('text'))
+        for word in text.casefold().split():
+            queryset = queryset.filter(
+                Q(folded_name__contains=word) | Q(folded_text__contains=word))
+        queryset = queryset.annotate(search_rank=Case(
+            When(folded_name__contains=text.casefold(), then=Value(1)),
+            default=Value(0),
+            output_field=IntegerField(),
+        ))
+    return queryset.order_by('-search_rank', '-created')
@@ -1,12 +1,27 @@
 import base64
+import os
+import re
+from collections import Counter
+from functools import cached_property
 
 from rest_framework.fields import HiddenField
-from rest_framework.validators import UniqueTogetherValidator
+from rest_framework.settings import api_settings
+from rest_framework.utils import html
+from django.conf import settings
 from django.contrib.auth import get_user_model
-from django.core.files.base import ContentFile
+from django.core.exceptions import ValidationError as DjangoValidationError
+from django.core.files.base import ContentFile, File
+from django.core.validators import get_available_image_extensions
+from django.db import IntegrityError, connection, transaction
+from django.db.models import F, Window, prefetch_related_objects
+from django.db.models.functions import RowNumber
+from django.utils.datastructures import MultiValueDict
 from rest_framework.serializers import (
     ImageField,
+    ListField,
+    ListSerializer,
     ModelSerializer,
+    Serializer,
     IntegerField,
     ReadOnlyField,
     BooleanField,
@@ -19,20 +34,40 @@ from recipes.models import (
     Ingredient,
     Tag,
     Recipe,
+    ImageUpload,
     IngredientInRecipe,
     Favorite,
     ShopingCart,
+    ShoppingListItem,
+    recipe_digest,
 )
+from recipes.shopping_list import change_recipe
 from users.models import Follow
+from .catalog import all_exist, ingredient_ids, tag_ids
+from .cache import (
+    get_recipe_representations,
+    get_user_recipe_ids,
+    set_recipe_representations,
+)
+from .images import image_urls
 
 
 User = get_user_model()
 
+RECIPE_PREFETCH = ('tags', 'recipeingredients__ingredient')
+NESTED_KEY = re.compile(r'^(\w+\[\d+\])\[(\w+)\]$')
+
 
 class Base64ImageField(ImageField):
+    """Изображение в виде data URI, файла multipart или upload:<token>."""
+
+    upload_prefix = 'upload:'
 
     def to_internal_value(self, str_base64):
         if (isinstance(str_base64, str)
+                and str_base64.startswith(self.upload_prefix)):
+            str_base64 = self.get_upload(str_base64[len(self.upload_prefix):])
+        elif (isinstance(str_base64, str)
                 and str_base64.startswith('data:image')):
             format, imgstr = str_base64.split(';base64,')
             ext = format.split('/')[-1]
@@ -43,6 +78,46 @@ class Base64ImageField(ImageField):
 
         return super().to_internal_value(str_base64)
 
+    def get_upload(self, token):
+        """Открывает завершенную загрузку текущего пользователя."""
+        try:
+            upload = ImageUpload.objects.get(
+                token=token, user=self.context['request'].user)
+        except (ImageUpload.DoesNotExist, DjangoValidationError):
+            raise ValidationError('Загрузка не найдена.')
+        if not upload.complete:
+            raise ValidationError('Загрузка еще не завершена.')
+        image = File(open(upload.path, 'rb'), name=upload.filename)
+        image.upload = upload
+        self.upload_file = image
+        return image
+
+    def close_upload(self):
+        """Закрывает файл загрузки, если рецепт не прошел проверку."""
+        image = getattr(self, 'upload_file', None)
+        if image is not None:
+            image.close()
+
+
+def flatten_nested_keys(data):
+    """Приводит ключи multipart вида items[0][id] к items[0]id.
+
+    DRF разбирает вложенные списки только во втором виде, клиенты
+    обычно отправляют первый.
+    """
+    flat = MultiValueDict()
+    for key, values in data.lists():
+        flat.setlist(NESTED_KEY.sub(r'\1\2', key), values)
+    return flat
+
+
+def discard_upload(image):
+    """Удаляет загрузку, из которой взято изображение рецепта."""
+    upload = getattr(image, 'upload', None)
+    if upload is not None:
+        image.close()
+        transaction.on_commit(upload.discard)
+
 
 class TagSerializer(ModelSerializer):
 
@@ -72,6 +147,20 @@ class RecipeIngredientSerializer(ModelSerializer):
         model = IngredientInRecipe
 
 
+class ShoppingListItemSerializer(ModelSerializer):
+    """Вывод ингредиента из списка покупок."""
+
+    id = ReadOnlyField(source='ingredient.id')
+    name = ReadOnlyField(source='ingredient.name')
+    measurement_unit = ReadOnlyField(
+        source='ingredient.measurement_unit'
+    )
+
+    class Meta:
+        fields = ('id', 'name', 'measurement_unit', 'amount',)
+        model = ShoppingListItem
+
+
 class AddIngredientToRecipeSerializer(ModelSerializer):
     """Добавление игнредиентов в рецепт."""
 
@@ -101,21 +190,61 @@ class UserSerializer(ModelSerializer):
 class RecipeForExtraActionsSerializer(ModelSerializer):
     """Отображение рецепта при подписке и добавлении в избранное."""
 
+    images = SerializerMethodField()
+
     class Meta:
         fields = (
             'id',
             'name',
             'image',
+            'images',
             'cooking_time',
         )
         model = Recipe
 
+    def get_images(self, obj):
+        return image_urls(obj)
+
+
+def latest_recipes(author_ids, limit=None):
+    """Последние limit рецептов каждого автора одним запросом.
+
+    Номер рецепта внутри автора считает ROW_NUMBER() OVER (PARTITION BY
+    author_id), отбор по нему делается во внешнем запросе.
+    """
+    if not author_ids:
+        return {}
+    ranked = Recipe.objects.filter(author_id__in=author_ids).only(
+        'id', 'author_id', 'name', 'image', 'image_variants',
+        'cooking_time',
+    ).annotate(recipe_rank=Window(
+        RowNumber(),
+        partition_by=F('author_id'),
+        order_by=(F('created').desc(), F('id').desc()),
+    )).order_by()
+    sql, params = ranked.query.sql_with_params()
+    sql = f'SELECT * FROM ({sql}) ranked'
+    if limit is not None:
+        sql += ' WHERE ranked.recipe_rank <= %s'
+        params += (limit,)
+    recipes = {pk: [] for pk in author_ids}
+    for recipe in Recipe.objects.raw(f'{sql} ORDER BY ranked.recipe_rank',
+                                     params):
+        recipes[recipe.author_id].append(recipe)
+    return recipes
+
+
+class FollowListSerializer(ListSerializer):
+    """Отображение подписок с рецептами всех авторов одним запросом."""
+
+    def to_representation(self, data):
+        return self.child.represent_many(list(data))
+
 
 class FollowSerializer(UserSerializer):
     """Вывод подписок пользователя."""
 
     recipes = SerializerMethodField()
-    recipes_count = ReadOnlyField(source='recipes.count')
 
     class Meta:
         fields = (
@@ -129,20 +258,45 @@ class FollowSerializer(UserSerializer):
             'recipes_count',
         )
         model = User
+        list_serializer_class = FollowListSerializer
 
-    def get_recipes(self, obj):
+    recipes_by_author = None
+
+    @cached_property
+    def recipes_limit(self):
         query_params = self.context.get('request').query_params
         try:
             recipes_limit = int(query_params.get('recipes_limit'))
-        except TypeError:
-            recipes_limit = None
-        return RecipeForExtraActionsSerializer(
-            obj.recipes.all()[:recipes_limit],
-            many=True).data
+        except (TypeError, ValueError):
+            return None
+        return max(recipes_limit, 0)
+
+    def represent_many(self, authors):
+        self.recipes_by_author = latest_recipes(
+            [author.pk for author in authors], self.recipes_limit)
+        return [self.to_representation(author) for author in authors]
+
+    def get_recipes(self, obj):
+        if self.recipes_by_author is None:
+            recipes = latest_recipes((obj.pk,), self.recipes_limit)[obj.pk]
+        else:
+            recipes = self.recipes_by_author[obj.pk]
+        return RecipeForExtraActionsSerializer(recipes, many=True).data
+
+
+class RecipeListSerializer(ListSerializer):
+    """Отображение списка рецептов одним обращением к кэшу."""
+
+    def to_representation(self, data):
+        return self.child.represent_many(list(data))
 
 
 class RecipeReadSerializer(ModelSerializer):
-    """Отображение рецепта с дополнительными полями."""
+    """Отображение рецепта с дополнительными полями.
+
+    Общая для всех пользователей часть берется из кэша, флаги
+    пользователя вычисляются по закэшированным множествам id.
+    """
 
     tags = TagSerializer(read_only=True, many=True)
     author = UserSerializer(read_only=True)
@@ -150,6 +304,7 @@ class RecipeReadSerializer(ModelSerializer):
         many=True, source='recipeingredients'
     )
     image = SerializerMethodField(read_only=True)
+    images = SerializerMethodField()
     is_favorited = BooleanField(read_only=True, default=False)
     is_in_shopping_cart = BooleanField(read_only=True, default=False)
 
@@ -161,23 +316,75 @@ class RecipeReadSerializer(ModelSerializer):
             'ingredients',
             'name',
             'image',
+            'images',
             'text',
             'cooking_time',
             'is_favorited',
             'is_in_shopping_cart',
         )
         model = Recipe
+        list_serializer_class = RecipeListSerializer
+
+    user_fields = ('is_favorited', 'is_in_shopping_cart',)
 
     def get_image(self, obj):
         if obj.image:
             return obj.image.url
         return None
 
+    def get_images(self, obj):
+        """Копии для карточки и страницы рецепта в WebP и JPEG."""
+        return image_urls(obj)
+
+    def to_representation(self, instance):
+        return self.represent_many([instance])[0]
+
+    def represent_many(self, recipes):
+        """Собирает представления, сериализуя только промахи кэша."""
+        cached, keys = get_recipe_representations(recipes)
+        missing = [recipe for recipe in recipes if recipe.pk not in cached]
+        if missing:
+            prefetch_related_objects(missing, *RECIPE_PREFETCH)
+            fresh = {
+                recipe.pk: self.shared_representation(recipe)
+                for recipe in missing
+            }
+            set_recipe_representations(
+                {keys[pk]: data for pk, data in fresh.items()})
+            cached.update(fresh)
+        return [
+            self.add_user_fields(cached[recipe.pk], recipe)
+            for recipe in recipes
+        ]
+
+    def shared_representation(self, instance):
+        data = super().to_representation(instance)
+        for field in self.user_fields:
+            data.pop(field)
+        return data
+
+    @cached_property
+    def user_recipe_ids(self):
+        return get_user_recipe_ids(self.context.get('request').user)
+
+    def add_user_fields(self, data, instance):
+        data = data.copy()
+        for field in self.user_fields:
+            data[field] = instance.pk in self.user_recipe_ids[field]
+        return data
+
 
 class RecipeWriteSerializer(ModelSerializer):
-    """Сериализатор создания и редактирования рецепта."""
+    """Сериализатор создания и редактирования рецепта.
+
+    Принимает JSON или multipart. В multipart теги передаются
+    повторяющимся полем tags, ингредиенты — полями ingredients[0][id]
+    и ingredients[0][amount] (или ingredients[0]id), изображение —
+    файлом, data URI или upload:<token>.
+    """
 
     author = HiddenField(default=CurrentUserDefault())
+    tags = ListField(child=IntegerField(min_value=1))
     ingredients = AddIngredientToRecipeSerializer(
         many=True, default=None
     )
@@ -196,25 +403,55 @@ class RecipeWriteSerializer(ModelSerializer):
             'cooking_time',
         )
         model = Recipe
-        validators = [
-            UniqueTogetherValidator(
-                queryset=Recipe.objects.all(),
-                fields=('author', 'name', 'text'),
-                message=(
-                    'Вы уже публиковали рецепт с таким названием и описанием!'
-                )
-            )
-        ]
+
+    duplicate_message = (
+        'Вы уже публиковали рецепт с таким названием и описанием!')
+
+    def to_internal_value(self, data):
+        if html.is_html_input(data):
+            data = flatten_nested_keys(data)
+        return super().to_internal_value(data)
+
+    def is_valid(self, raise_exception=False):
+        try:
+            return super().is_valid(raise_exception=raise_exception)
+        finally:
+            if self._errors:
+                self.fields['image'].close_upload()
+
+    def save(self, **kwargs):
+        """Повтор рецепта отклоняет уникальный индекс по хешу."""
+        try:
+            with transaction.atomic():
+                return super().save(**kwargs)
+        except IntegrityError:
+            if not self.is_duplicate():
+                raise
+            raise ValidationError(
+                {api_settings.NON_FIELD_ERRORS_KEY: [self.duplicate_message]})
+
+    def is_duplicate(self):
+        data = {
+            field: self.validated_data.get(
+                field, getattr(self.instance, field, None))
+            for field in ('author', 'name', 'text')
+        }
+        duplicates = Recipe.objects.filter(
+            author=data['author'],
+            digest=recipe_digest(data['name'], data['text']),
+        )
+        if self.instance is not None:
+            duplicates = duplicates.exclude(pk=self.instance.pk)
+        return duplicates.exists()
 
     def validate_tags(self, data):
         if not data:
             raise ValidationError('Укажите хотябы один тег!')
-        tags_id = [tag.id for tag in data]
-        if len(tags_id) != len(set(tags_id)):
+        if len(data) != len(set(data)):
             raise ValidationError(
                 'Теги в вашем рецепте повторяются. '
                 'Проверьте и устраните повторы.')
-        if len(tags_id) != len(Tag.objects.in_bulk(tags_id)):
+        if not all_exist(tag_ids, data):
             raise ValidationError('Указан не существующий тег!')
         return data
 
@@ -226,8 +463,7 @@ class RecipeWriteSerializer(ModelSerializer):
             raise ValidationError(
                 'Ингредиенты в вашем рецепте повторяются. '
                 'Проверьте и устраните повторы.')
-        if (len(ingredients_id)
-                != len(Ingredient.objects.in_bulk(ingredients_id))):
+        if not all_exist(ingredient_ids, ingredients_id):
             raise ValidationError('Указан не существующий ингредиент!')
         return data
 
@@ -242,22 +478,82 @@ class RecipeWriteSerializer(ModelSerializer):
         ]
         IngredientInRecipe.objects.bulk_create(objs)
 
+    def update_ingredients(self, recipe, ingredients):
+        """Меняет только отличающиеся строки ингредиентов рецепта.
+
+        Возвращает изменения количеств {ingredient_id: delta}.
+        """
+        amounts = {
+            ingredient['id']: ingredient['amount']
+            for ingredient in ingredients
+        }
+        deltas = Counter()
+        existing = set()
+        changed = []
+        removed = []
+        for row in IngredientInRecipe.objects.filter(recipe=recipe):
+            amount = amounts.get(row.ingredient_id)
+            if amount is None or row.ingredient_id in existing:
+                deltas[row.ingredient_id] -= row.amount
+                removed.append(row.pk)
+                continue
+            existing.add(row.ingredient_id)
+            if row.amount != amount:
+                deltas[row.ingredient_id] += amount - row.amount
+                row.amount = amount
+                changed.append(row)
+        added = [
+            ingredient for ingredient in ingredients
+            if ingredient['id'] not in existing
+        ]
+        for ingredient in added:
+            deltas[ingredient['id']] += ingredient['amount']
+        if removed:
+            self.delete_rows(removed)
+        if changed:
+            IngredientInRecipe.objects.bulk_update(changed, ('amount',))
+        if added:
+            self.add_ingredients_to_recipe(recipe, added)
+        return deltas
+
+    def delete_rows(self, pks):
+        """Удаляет строки ингредиентов одним DELETE без сигналов.
+
+        Рецепт сохраняется после этого целиком, а списки покупок
+        обновляет update, как и после bulk_update и bulk_create.
+        """
+        quote = connection.ops.quote_name
+        opts = IngredientInRecipe._meta
+        with connection.cursor() as cursor:
+            cursor.execute(
+                f'DELETE FROM {quote(opts.db_table)} '
+                f'WHERE {quote(opts.pk.column)} '
+                f'IN ({", ".join(["%s"] * len(pks))})',
+                pks,
+            )
+
     def create(self, validated_data):
         ingredients = validated_data.pop('ingredients')
+        tags = validated_data.pop('tags')
         recipe = super().create(validated_data)
+        Recipe.tags.through.objects.bulk_create(
+            Recipe.tags.through(recipe=recipe, tag_id=pk) for pk in tags)
         self.add_ingredients_to_recipe(recipe, ingredients)
+        discard_upload(validated_data['image'])
         return recipe
 
+    @transaction.atomic
     def update(self, recipe, validated_data):
         ingredients = validated_data.pop('ingredients', None)
         tags = validated_data.pop('tags', None)
         if tags is None or ingredients is None:
             raise ValidationError(
                 'Указание тегов и ингредиентов обязательно!')
-        recipe.ingredients.clear()
-        self.add_ingredients_to_recipe(recipe, ingredients)
+        change_recipe(recipe, self.update_ingredients(recipe, ingredients))
         recipe.tags.set(tags)
-        return super().update(recipe, validated_data)
+        recipe = super().update(recipe, validated_data)
+        discard_upload(validated_data.get('image'))
+        return recipe
 
     def to_representation(self, instance):
         return RecipeReadSerializer(
@@ -271,13 +567,6 @@ class FavoriteSerializer(ModelSerializer):
     class Meta:
         fields = ('recipe', 'user',)
         model = Favorite
-        validators = [
-            UniqueTogetherValidator(
-                queryset=model.objects.all(),
-                fields=('recipe', 'user'),
-                message='Рецепт уже в избранном',
-            )
-        ]
 
     def to_representation(self, instance):
         return RecipeForExtraActionsSerializer(
@@ -291,13 +580,6 @@ class ShopingCartSerializer(FavoriteSerializer):
     class Meta:
         fields = ('recipe', 'user',)
         model = ShopingCart
-        validators = [
-            UniqueTogetherValidator(
-                queryset=model.objects.all(),
-                fields=('recipe', 'user'),
-                message='Рецепт уже в списке покупок',
-            )
-        ]
 
 
 class SubscribeSerializer(ModelSerializer):
@@ -305,24 +587,42 @@ class SubscribeSerializer(ModelSerializer):
     class Meta:
         fields = ('following', 'user',)
         model = Follow
-        validators = [
-            UniqueTogetherValidator(
-                queryset=model.objects.all(),
-                fields=('following', 'user'),
-                message='Нельзя дважды подписаться на одного блогера!',
-            )
-        ]
-
-    def validate_following(self, data):
-        request = self.context.get('request')
-        user = request.user
-        if user == data:
-            raise ValidationError(
-                'Нельзя подписаться на себя!')
-        return data
 
     def to_representation(self, instance):
         return FollowSerializer(
             instance.following,
             context={'request': self.context.get('request')}
         ).data
+
+
+class BulkIdsSerializer(Serializer):
+    """Список id для пакетного добавления или удаления."""
+
+    ids = ListField(
+        child=IntegerField(min_value=1),
+        allow_empty=False,
+        max_length=settings.BULK_MAX_IDS,
+    )
+
+    def validate_ids(self, ids):
+        return list(dict.fromkeys(ids))
+
+
+class ImageUploadSerializer(ModelSerializer):
+    """Начало и состояние загрузки изображения частями."""
+
+    offset = IntegerField(source='received', read_only=True)
+    complete = BooleanField(read_only=True)
+    size = IntegerField(min_value=1, max_value=settings.UPLOAD_MAX_SIZE)
+
+    class Meta:
+        model = ImageUpload
+        fields = ('token', 'filename', 'size', 'offset', 'complete')
+        read_only_fields = ('token',)
+
+    def validate_filename(self, filename):
+        filename = os.path.basename(filename.replace('\\', '/'))
+        extension = os.path.splitext(filename)[1].lower().lstrip('.')
+        if extension not in get_available_image_extensions():
+            raise ValidationError('Неподдерживаемый формат изображения.')
+        return filename
@@ -0,0 +1,97 @@
+"""Потоковая выгрузка списка покупок в форматах txt, csv и pdf.
+
+Строки списка приходят итератором по серверному курсору, текстовые
+форматы отдаются по мере формирования. PDF требует таблицу ссылок
+в конце файла, поэтому он собирается во временном файле, который
+держится в памяти только до SHOPPING_LIST_SPOOL_SIZE байт.
+"""
+import csv
+from tempfile import SpooledTemporaryFile
+
+from django.conf import settings
+from reportlab.lib.pagesizes import A4
+from reportlab.lib.units import mm
+from reportlab.lib.utils import simpleSplit
+from reportlab.pdfbase import pdfmetrics
+from reportlab.pdfbase.ttfonts import TTFont
+from reportlab.pdfgen.canvas import Canvas
+
+TITLE = 'Список покупок:'
+CHUNK_SIZE = 8 * 1024
+PDF_FONT = 'ShoppingListFont'
+PDF_FONT_SIZE = 12
+PDF_MARGIN = 20 * mm
+
+
+def chunked(lines):
+    """Склеивает строки в блоки, чтобы не отправлять их по одной."""
+    chunk = []
+    size = 0
+    for line in lines:
+        data = line.encode('utf-8')
+        chunk.append(data)
+        size += len(data)
+        if size >= CHUNK_SIZE:
+            yield b''.join(chunk)
+            chunk, size = [], 0
+    if chunk:
+        yield b''.join(chunk)
+
+
+def txt_lines(rows):
+    yield TITLE + '\n'
+    for name, measurement_unit, amount in rows:
+        yield f'\n{name.capitalize()}({measurement_unit}) - {amount}'
+
+
+class Echo:
+    """Файлоподобный объект, возвращающий записанную строку."""
+
+    def write(self, value):
+        return value
+
+
+def csv_lines(rows):
+    writer = csv.writer(Echo())
+    yield '﻿' + writer.writerow(
+        ('Ингредиент', 'Единица измерения', 'Количество'))
+    for name, measurement_unit, amount in rows:
+        yield writer.writerow((name.capitalize(), measurement_unit, amount))
+
+
+def pdf_file(rows):
+    """Возвращает временный файл с PDF и его размер."""
+    if PDF_FONT not in pdfmetrics.getRegisteredFontNames():
+        pdfmetrics.registerFont(
+            TTFont(PDF_FONT, settings.SHOPPING_LIST_PDF_FONT))
+    output = SpooledTemporaryFile(max_size=settings.SHOPPING_LIST_SPOOL_SIZE)
+    canvas = Canvas(output, pagesize=A4)
+    width, height = A4
+    line_height = PDF_FONT_SIZE * 1.5
+    max_width = width - 2 * PDF_MARGIN
+    top = height - PDF_MARGIN
+    y = top
+
+    def draw(text):
+        nonlocal y
+        for line in simpleSplit(text, PDF_FONT, PDF_FONT_SIZE, max_width):
+            if y < PDF_MARGIN:
+                canvas.showPage()
+                y = top
+            canvas.setFont(PDF_FONT, PDF_FONT_SIZE)
+            canvas.drawString(PDF_MARGIN, y, line)
+            y -= line_height
+
+    draw(TITLE)
+    for name, measurement_unit, amount in rows:
+        draw(f'{name.capitalize()}({measurement_unit}) - {amount}')
+    canvas.save()
+    size = output.tell()
+    output.seek(0)
+    return output, size
+
+
+FORMATS = {
+    'txt': txt_lines,
+    'csv': csv_lines,
+}
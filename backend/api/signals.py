@@ -0,0 +1,299 @@
+import threading
+from collections import Counter, defaultdict
+
+from django.contrib.auth import get_user_model
+from django.db.models.signals import (
+    m2m_changed,
+    post_delete,
+    post_save,
+    pre_delete,
+    pre_save,
+)
+from django.dispatch import receiver
+from django.utils import timezone
+
+from users.models import Follow
+
+from recipes.counters import (
+    change_favorites_count,
+    change_followers_count,
+    change_recipes_count,
+)
+from recipes.feed import fan_out, follow_authors, unfollow_authors
+from recipes.models import (
+    Favorite,
+    Ingredient,
+    IngredientInRecipe,
+    Recipe,
+    ShopingCart,
+    Tag,
+)
+from recipes.shopping_list import (
+    add_recipes,
+    change_recipe,
+    recipe_amounts,
+    remove_recipes,
+)
+from .cache import (
+    USER_RECIPE_MODELS,
+    forget_user_recipe_ids,
+    invalidate_author,
+    invalidate_catalog,
+    invalidate_recipe,
+)
+from .images import image_pipeline, needs_processing
+from .ingredient_index import ingredient_index
+
+User = get_user_model()
+
+
+class Deleting(threading.local):
+    """id объектов, удаляемых в текущем потоке.
+
+    Каскад удаляет зависимые строки по одной, с сигналом на каждую.
+    Производные данные удаляемого объекта обновляются пачкой в его
+    pre_delete, поэтому обработчики зависимых строк их не трогают.
+    """
+
+    def __init__(self):
+        self.ids = defaultdict(set)
+
+    def __contains__(self, key):
+        model, pk = key
+        return pk in self.ids[model]
+
+    def add(self, instance):
+        self.ids[type(instance)].add(instance.pk)
+
+    def discard(self, instance):
+        self.ids[type(instance)].discard(instance.pk)
+
+
+deleting = Deleting()
+
+
+def touch_recipes(**lookup):
+    """Отмечает изменение рецептов, не сохраняя их целиком."""
+    Recipe.objects.filter(**lookup).update(updated=timezone.now())
+
+
+@receiver(post_save, sender=Recipe)
+@receiver(post_delete, sender=Recipe)
+def recipe_changed(sender, instance, **kwargs):
+    invalidate_recipe(instance.pk)
+
+
+@receiver(post_save, sender=Recipe)
+def recipe_image_changed(sender, instance, **kwargs):
+    if needs_processing(instance):
+        image_pipeline.schedule(instance)
+
+
+@receiver(post_save, sender=Recipe)
+def recipe_created(sender, instance, created, **kwargs):
+    if created:
+        change_recipes_count(instance.author_id, 1)
+        fan_out(instance)
+
+
+@receiver(post_delete, sender=Recipe)
+def recipe_removed(sender, instance, **kwargs):
+    deleting.discard(instance)
+    if (User, instance.author_id) not in deleting:
+        change_recipes_count(instance.author_id, -1)
+
+
+@receiver(pre_delete, sender=Recipe)
+def recipe_deleted(sender, instance, **kwargs):
+    """Убирает удаляемый рецепт из избранного и списков покупок."""
+    deleting.add(instance)
+    for model in USER_RECIPE_MODELS.values():
+        forget_user_recipe_ids(model, model.objects.filter(
+            recipe=instance).values_list('user_id', flat=True))
+    change_recipe(instance, {
+        pk: -amount
+        for pk, amount in recipe_amounts((instance.pk,)).items()
+    })
+
+
+@receiver(post_save, sender=IngredientInRecipe)
+@receiver(post_delete, sender=IngredientInRecipe)
+def recipe_ingredient_changed(sender, instance, **kwargs):
+    if (Recipe, instance.recipe_id) in deleting:
+        return
+    touch_recipes(pk=instance.recipe_id)
+    invalidate_recipe(instance.recipe_id)
+
+
+@receiver(pre_save, sender=IngredientInRecipe)
+def recipe_ingredient_saving(sender, instance, **kwargs):
+    """Запоминает прежнюю строку, чтобы перенести разницу в списки."""
+    instance._previous_row = instance.pk and IngredientInRecipe.objects.filter(
+        pk=instance.pk).values_list(
+        'recipe_id', 'ingredient_id', 'amount').first()
+
+
+@receiver(post_save, sender=IngredientInRecipe)
+def recipe_ingredient_saved(sender, instance, **kwargs):
+    """Переносит изменение строки в списки покупок.
+
+    API пишет строки пачками без сигналов и вызывает change_recipe сам,
+    сюда попадают админка и shell.
+    """
+    changes = defaultdict(Counter)
+    if instance._previous_row:
+        recipe_id, ingredient_id, amount = instance._previous_row
+        changes[recipe_id][ingredient_id] -= amount
+    changes[instance.recipe_id][instance.ingredient_id] += instance.amount
+    for recipe_id, deltas in changes.items():
+        change_recipe(recipe_id, deltas)
+
+
+@receiver(post_delete, sender=IngredientInRecipe)
+def recipe_ingredient_removed(sender, instance, **kwargs):
+    if (Recipe, instance.recipe_id) not in deleting:
+        change_recipe(
+            instance.recipe_id, {instance.ingredient_id: -instance.amount})
+
+
+@receiver(m2m_changed, sender=Recipe.ingredients.through)
+def recipe_ingredients_changed(sender, instance, action, reverse, pk_set,
+                               **kwargs):
+    """Списки покупок при изменении через recipe.ingredients.
+
+    До изменения количества затронутых рецептов вычитаются из списков,
+    после — прибавляются заново.
+    """
+    if action.startswith('pre_'):
+        if not reverse:
+            recipes = [instance.pk]
+        elif pk_set is not None:
+            recipes = list(pk_set)
+        else:
+            recipes = list(IngredientInRecipe.objects.filter(
+                ingredient=instance).values_list('recipe_id', flat=True))
+        instance._shopping_recipes = recipes
+        sign = -1
+    else:
+        recipes = instance.__dict__.pop('_shopping_recipes', ())
+        sign = 1
+    for pk in recipes:
+        change_recipe(pk, {
+            ingredient: sign * amount
+            for ingredient, amount in recipe_amounts((pk,)).items()
+        })
+
+
+@receiver(m2m_changed, sender=Recipe.tags.through)
+@receiver(m2m_changed, sender=Recipe.ingredients.through)
+def recipe_relations_changed(sender, instance, action, reverse, pk_set,
+                             **kwargs):
+    if reverse and action == 'pre_clear':
+        relation = 'tags' if sender is Recipe.tags.through else 'ingredients'
+        touch_recipes(**{relation: instance})
+        return
+    if action not in ('post_add', 'post_remove', 'post_clear'):
+        return
+    if not reverse:
+        touch_recipes(pk=instance.pk)
+        invalidate_recipe(instance.pk)
+    elif pk_set is None:
+        invalidate_catalog(type(instance))
+    else:
+        touch_recipes(pk__in=pk_set)
+        for pk in pk_set:
+            invalidate_recipe(pk)
+
+
+@receiver(post_save, sender=Tag)
+@receiver(post_delete, sender=Tag)
+@receiver(post_save, sender=Ingredient)
+@receiver(post_delete, sender=Ingredient)
+def catalog_changed(sender, **kwargs):
+    invalidate_catalog(sender)
+
+
+@receiver(post_save, sender=Ingredient)
+@receiver(post_delete, sender=Ingredient)
+def ingredient_changed(sender, **kwargs):
+    ingredient_index.schedule_rebuild()
+
+
+@receiver(post_save, sender=User)
+def author_changed(sender, instance, update_fields, **kwargs):
+    """Сбрасывает представления рецептов автора при смене профиля.
+
+    Сохранение одного last_login при входе на профиль не влияет.
+    """
+    if update_fields and set(update_fields) <= {'last_login'}:
+        return
+    touch_recipes(author=instance)
+    invalidate_author(instance.pk)
+
+
+@receiver(post_save, sender=Favorite)
+def favorite_added(sender, instance, created, **kwargs):
+    """Производные данные связей, измененных через модель.
+
+    Сюда попадают админка, shell и каскадное удаление. API меняет связи
+    SQL-запросами без сигналов и обновляет эти данные сам.
+    """
+    if created:
+        change_favorites_count((instance.recipe_id,), 1)
+        forget_user_recipe_ids(Favorite, (instance.user_id,))
+
+
+@receiver(post_delete, sender=Favorite)
+def favorite_removed(sender, instance, **kwargs):
+    if ((Recipe, instance.recipe_id) in deleting
+            or (User, instance.user_id) in deleting):
+        return
+    change_favorites_count((instance.recipe_id,), -1)
+    forget_user_recipe_ids(Favorite, (instance.user_id,))
+
+
+@receiver(post_save, sender=ShopingCart)
+def cart_added(sender, instance, created, **kwargs):
+    if created:
+        forget_user_recipe_ids(ShopingCart, (instance.user_id,))
+        add_recipes(instance.user_id, (instance.recipe_id,))
+
+
+@receiver(post_delete, sender=ShopingCart)
+def cart_removed(sender, instance, **kwargs):
+    if ((Recipe, instance.recipe_id) in deleting
+            or (User, instance.user_id) in deleting):
+        return
+    forget_user_recipe_ids(ShopingCart, (instance.user_id,))
+    remove_recipes(instance.user_id, (instance.recipe_id,))
+
+
+@receiver(post_save, sender=Follow)
+def follow_added(sender, instance, created, **kwargs):
+    if created:
+        change_followers_count((instance.following_id,), 1)
+        follow_authors(instance.user_id, (instance.following_id,))
+
+
+@receiver(post_delete, sender=Follow)
+def follow_removed(sender, instance, **kwargs):
+    if ((User, instance.following_id) in deleting
+            or (User, instance.user_id) in deleting):
+        return
+    change_followers_count((instance.following_id,), -1)
+    unfollow_authors(instance.user_id, (instance.following_id,))
+
+
+@receiver(pre_delete, sender=User)
+def user_deleted(sender, instance, **kwargs):
+    """Уменьшает пачкой счетчики, которые затронет каскадное удаление."""
+    deleting.add(instance)
+    change_favorites_count(
+        Favorite.objects.filter(user=instance).values('recipe'), -1)
+    change_followers_count(
+        Follow.objects.filter(user=instance).values('following'), -1)
+
+
+@receiver(post_delete, sender=User)
+def user_removed(sender, instance, **kwargs):
+    deleting.discard(instance)
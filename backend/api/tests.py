@@ -0,0 +1,965 @@
+import base64
+import io
+import json
+import os
+import shutil
+import tempfile
+import threading
+from unittest import mock, skipUnless
+
+from django.contrib.auth import get_user_model
+from django.core.cache import cache
+from django.core.management import call_command
+from django.db import connection
+from django.forms import modelform_factory
+from django.test import TestCase, TransactionTestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from PIL import Image
+from rest_framework.test import APIClient
+
+from recipes.admin import RecipeAdminForm
+from recipes.export import export_lines
+from recipes.models import (
+    Favorite,
+    FeedEntry,
+    ImageUpload,
+    Ingredient,
+    IngredientInRecipe,
+    Recipe,
+    ShopingCart,
+    ShoppingListItem,
+    Tag,
+)
+from recipes.shopping_list import expected_items
+from users.models import Follow
+from .images import image_pipeline
+from .ingredient_index import IngredientIndex, index_path, ingredient_index
+from .serializers import RecipeWriteSerializer
+
+User = get_user_model()
+
+MEDIA_ROOT = tempfile.mkdtemp()
+
+
+def png_bytes():
+    buffer = io.BytesIO()
+    Image.new('RGB', (4, 4), 'red').save(buffer, 'PNG')
+    return buffer.getvalue()
+
+
+def png_image():
+    return 'data:image/png;base64,' + base64.b64encode(png_bytes()).decode()
+
+
+def writes(queries):
+    """Пары (команда, таблица) изменяющих запросов."""
+    found = []
+    for query in queries:
+        words = query['sql'].replace('"', '').split()
+        if words[0] in ('INSERT', 'DELETE'):
+            found.append((words[0], words[2]))
+        elif words[0] == 'UPDATE':
+            found.append((words[0], words[1]))
+    return found
+
+
+def make_client(user):
+    client = APIClient()
+    client.force_authenticate(user)
+    return client
+
+
+class RecipeAPITestMixin:
+    """Справочники, пользователи и рецепт, созданный через API."""
+
+    @classmethod
+    def tearDownClass(cls):
+        super().tearDownClass()
+        shutil.rmtree(MEDIA_ROOT, ignore_errors=True)
+
+    def setUp(self):
+        cache.clear()
+        patcher = mock.patch.object(image_pipeline, 'workers', 0)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.tags = [
+            Tag.objects.create(name=name, color=color, slug=slug).pk
+            for name, color, slug in (
+                ('Завтрак', '#ffffff', 'breakfast'),
+                ('Ужин', '#000000', 'dinner'),
+            )
+        ]
+        self.ingredients = [
+            Ingredient.objects.create(name=name, measurement_unit=unit).pk
+            for name, unit in (
+                ('Мука', 'г'), ('Молоко', 'мл'), ('Соль', 'г'), ('Яйца', 'шт'))
+        ]
+        self.author = User.objects.create(
+            email='author@example.com', username='author',
+            first_name='Автор', last_name='Рецептов')
+        self.author_client = make_client(self.author)
+
+    def recipe_data(self, amounts, **fields):
+        return {
+            'name': 'Блины',
+            'text': 'Смешать и пожарить.',
+            'cooking_time': 30,
+            'tags': self.tags[:1],
+            'image': png_image(),
+            'ingredients': [
+                {'id': pk, 'amount': amount} for pk, amount in amounts
+            ],
+            **fields,
+        }
+
+    def create_recipe(self, amounts, **fields):
+        response = self.author_client.post(
+            '/api/recipes/', self.recipe_data(amounts, **fields),
+            format='json')
+        self.assertEqual(response.status_code, 201, response.data)
+        return Recipe.objects.get(pk=response.data['id'])
+
+
+@skipUnless(connection.vendor == 'postgresql',
+            'SQLite блокирует таблицу при параллельной записи.')
+@override_settings(MEDIA_ROOT=MEDIA_ROOT)
+class IntermediateConcurrencyTest(RecipeAPITestMixin, TransactionTestCase):
+    """Параллельные добавления и удаления одной связи.
+
+    Потоки одновременно переключают избранное, список покупок
+    и подписку одного пользователя. Ни один запрос не должен
+    завершиться ошибкой сервера, а связь, счетчик и список покупок
+    в итоге должны соответствовать друг другу. Нагрузку задают
+    переменные окружения CONCURRENCY_THREADS и CONCURRENCY_ROUNDS,
+    по умолчанию это 480 запросов на каждый вид связи.
+    """
+    threads = int(os.getenv('CONCURRENCY_THREADS', 16))
+    rounds = int(os.getenv('CONCURRENCY_ROUNDS', 15))
+
+    def setUp(self):
+        super().setUp()
+        self.recipe = self.create_recipe(
+            ((self.ingredients[0], 200), (self.ingredients[1], 300)))
+        self.user = User.objects.create(
+            email='user@example.com', username='user',
+            first_name='Пользователь', last_name='Тестовый')
+
+    def toggle(self, url, bulk_url, pk):
+        """Переключает связь из нескольких потоков одновременно."""
+        barrier = threading.Barrier(self.threads)
+        statuses = []
+        errors = []
+
+        def run(number):
+            client = make_client(self.user)
+            try:
+                barrier.wait()
+                for step in range(self.rounds):
+                    if (number + step) % 2:
+                        responses = (
+                            client.post(url), client.delete(url))
+                    else:
+                        responses = (
+                            client.post(bulk_url, {'ids': [pk]},
+                                        format='json'),
+                            client.delete(bulk_url, {'ids': [pk]},
+                                          format='json'),
+                        )
+                    statuses.extend(
+                        response.status_code for response in responses)
+            except Exception as error:
+                errors.append(error)
+            finally:
+                connection.close()
+
+        workers = [
+            threading.Thread(target=run, args=(number,))
+            for number in range(self.threads)
+        ]
+        for worker in workers:
+            worker.start()
+        for worker in workers:
+            worker.join()
+        self.assertEqual(errors, [])
+        self.assertEqual(len(statuses), self.threads * self.rounds * 2)
+        self.assertTrue(
+            set(statuses) <= {200, 201, 204, 400}, sorted(set(statuses)))
+
+    def test_favorite_toggles(self):
+        pk = self.recipe.pk
+        self.toggle(f'/api/recipes/{pk}/favorite/',
+                    '/api/recipes/bulk_favorite/', pk)
+        links = Favorite.objects.filter(user=self.user, recipe=pk).count()
+        self.assertIn(links, (0, 1))
+        self.recipe.refresh_from_db()
+        self.assertEqual(self.recipe.favorites_count, links)
+
+    def test_shopping_cart_toggles(self):
+        pk = self.recipe.pk
+        self.toggle(f'/api/recipes/{pk}/shopping_cart/',
+                    '/api/recipes/bulk_shopping_cart/', pk)
+        links = ShopingCart.objects.filter(user=self.user, recipe=pk).count()
+        self.assertIn(links, (0, 1))
+        self.assertEqual(
+            set(ShoppingListItem.objects.filter(user=self.user).values_list(
+                'user_id', 'ingredient_id', 'amount')),
+            set(expected_items((self.user.pk,))),
+        )
+
+    def test_follow_toggles(self):
+        pk = self.author.pk
+        self.toggle(f'/api/users/{pk}/subscribe/',
+                    '/api/users/bulk_subscribe/', pk)
+        links = Follow.objects.filter(user=self.user, following=pk).count()
+        self.assertIn(links, (0, 1))
+        self.author.refresh_from_db()
+        self.assertEqual(self.author.followers_count, links)
+
+
+@override_settings(MEDIA_ROOT=MEDIA_ROOT)
+class RecipeWriteVolumeTest(RecipeAPITestMixin, TestCase):
+    """Изменение рецепта пишет только отличающиеся строки."""
+
+    def setUp(self):
+        super().setUp()
+        self.recipe = self.create_recipe(
+            ((self.ingredients[0], 200), (self.ingredients[1], 300)))
+        self.url = f'/api/recipes/{self.recipe.pk}/'
+
+    def edit(self, amounts):
+        data = self.recipe_data(amounts)
+        del data['image']
+        with CaptureQueriesContext(connection) as context:
+            response = self.author_client.patch(self.url, data, format='json')
+        self.assertEqual(response.status_code, 200, response.data)
+        return writes(context.captured_queries)
+
+    def test_no_change(self):
+        flour, milk, salt, _ = self.ingredients
+        self.assertEqual(
+            self.edit(((flour, 200), (milk, 300))),
+            [('UPDATE', 'recipes_recipe')],
+        )
+
+    def test_amount_changed(self):
+        flour, milk, salt, _ = self.ingredients
+        self.assertEqual(
+            self.edit(((flour, 250), (milk, 300))),
+            [('UPDATE', 'recipes_ingredientinrecipe'),
+             ('UPDATE', 'recipes_recipe')],
+        )
+
+    def test_ingredient_swapped(self):
+        flour, milk, salt, _ = self.ingredients
+        self.assertEqual(
+            self.edit(((flour, 200), (salt, 300))),
+            [('DELETE', 'recipes_ingredientinrecipe'),
+             ('INSERT', 'recipes_ingredientinrecipe'),
+             ('UPDATE', 'recipes_recipe')],
+        )
+
+
+@override_settings(MEDIA_ROOT=MEDIA_ROOT)
+class RecipeQueryCountTest(RecipeAPITestMixin, TestCase):
+    """Число запросов создания и изменения рецепта.
+
+    Теги и ингредиенты пишутся пачками, поэтому число запросов
+    не зависит от их количества.
+    """
+
+    def test_create(self):
+        data = self.recipe_data(
+            [(pk, 100) for pk in self.ingredients], tags=self.tags)
+        with self.assertNumQueries(14):
+            response = self.author_client.post(
+                '/api/recipes/', data, format='json')
+        self.assertEqual(response.status_code, 201, response.data)
+
+    def test_update(self):
+        flour, milk, salt, eggs = self.ingredients
+        recipe = self.create_recipe(((flour, 200), (milk, 300), (salt, 5)))
+        data = self.recipe_data(
+            ((flour, 250), (milk, 300), (eggs, 2)), tags=self.tags[1:])
+        del data['image']
+        with self.assertNumQueries(17):
+            response = self.author_client.patch(
+                f'/api/recipes/{recipe.pk}/', data, format='json')
+        self.assertEqual(response.status_code, 200, response.data)
+
+
+@override_settings(MEDIA_ROOT=MEDIA_ROOT)
+class ModelLinkSignalsTest(RecipeAPITestMixin, TestCase):
+    """Связи, измененные через модель (админка, shell, каскады)."""
+
+    def setUp(self):
+        super().setUp()
+        flour, milk, _, _ = self.ingredients
+        self.recipe = self.create_recipe(((flour, 200), (milk, 300)))
+        self.user = User.objects.create(
+            email='user@example.com', username='user',
+            first_name='Пользователь', last_name='Тестовый')
+        self.client = make_client(self.user)
+
+    def flags(self):
+        response = self.client.get(f'/api/recipes/{self.recipe.pk}/')
+        return response.data['is_favorited'], response.data[
+            'is_in_shopping_cart']
+
+    def filtered(self, name):
+        response = self.client.get('/api/recipes/', {name: 1})
+        return [recipe['id'] for recipe in response.data['results']]
+
+    def test_user_recipe_flags(self):
+        self.assertEqual(self.flags(), (False, False))
+        with self.captureOnCommitCallbacks(execute=True):
+            favorite = Favorite.objects.create(
+                user=self.user, recipe=self.recipe)
+            cart = ShopingCart.objects.create(
+                user=self.user, recipe=self.recipe)
+        self.assertEqual(self.flags(), (True, True))
+        self.assertEqual(self.filtered('is_favorited'), [self.recipe.pk])
+        with self.captureOnCommitCallbacks(execute=True):
+            favorite.delete()
+            cart.delete()
+        self.assertEqual(self.flags(), (False, False))
+        self.assertEqual(self.filtered('is_in_shopping_cart'), [])
+
+    def assertShoppingList(self, expected):
+        items = set(ShoppingListItem.objects.filter(
+            user=self.user).values_list('ingredient_id', 'amount'))
+        self.assertEqual(items, set(expected))
+        self.assertEqual(
+            {(self.user.pk, *item) for item in items},
+            set(expected_items((self.user.pk,))),
+        )
+
+    def test_shopping_list(self):
+        flour, milk, salt, eggs = self.ingredients
+        cart = ShopingCart.objects.create(user=self.user, recipe=self.recipe)
+        self.assertShoppingList({(flour, 200), (milk, 300)})
+        row = IngredientInRecipe.objects.get(
+            recipe=self.recipe, ingredient=flour)
+        row.amount = 250
+        row.save()
+        self.assertShoppingList({(flour, 250), (milk, 300)})
+        row.ingredient_id = salt
+        row.save()
+        self.assertShoppingList({(salt, 250), (milk, 300)})
+        row.delete()
+        self.assertShoppingList({(milk, 300)})
+        IngredientInRecipe.objects.create(
+            recipe=self.recipe, ingredient_id=eggs, amount=2)
+        self.assertShoppingList({(milk, 300), (eggs, 2)})
+        self.recipe.ingredients.add(flour, through_defaults={'amount': 7})
+        self.assertShoppingList({(milk, 300), (eggs, 2), (flour, 7)})
+        self.recipe.ingredients.remove(milk)
+        self.assertShoppingList({(eggs, 2), (flour, 7)})
+        cart.delete()
+        self.assertShoppingList(())
+
+    def test_shopping_list_after_recipe_delete(self):
+        ShopingCart.objects.create(user=self.user, recipe=self.recipe)
+        self.recipe.delete()
+        self.assertShoppingList(())
+
+    def delete_author(self, fans):
+        """Удаляет автора пяти рецептов, отмеченных fans пользователями.
+
+        Возвращает число запросов удаления.
+        """
+        author = User.objects.create(
+            email=f'author{fans}@example.com', username=f'author{fans}',
+            first_name='Автор', last_name='Удаляемый')
+        recipes = [
+            Recipe.objects.create(
+                author=author, name=f'Рецепт {number}', text='Текст',
+                cooking_time=5, image='recipes/images/test.png')
+            for number in range(5)
+        ]
+        for number in range(fans):
+            fan = User.objects.create(
+                email=f'fan{fans}-{number}@example.com',
+                username=f'fan{fans}-{number}',
+                first_name='Читатель', last_name='Тестовый')
+            Follow.objects.create(user=fan, following=author)
+            for recipe in recipes:
+                Favorite.objects.create(user=fan, recipe=recipe)
+                ShopingCart.objects.create(user=fan, recipe=recipe)
+        Follow.objects.create(user=author, following=self.author)
+        Favorite.objects.create(user=author, recipe=self.recipe)
+        with CaptureQueriesContext(connection) as context:
+            author.delete()
+        return len(context.captured_queries)
+
+    def test_user_delete_counters(self):
+        self.assertEqual(self.delete_author(1), self.delete_author(4))
+        self.author.refresh_from_db()
+        self.recipe.refresh_from_db()
+        self.assertEqual(self.author.followers_count, 0)
+        self.assertEqual(self.recipe.favorites_count, 0)
+
+
+class IngredientIndexTest(TestCase):
+    """Файл индекса привязан к базе и к версии справочника."""
+
+    def setUp(self):
+        cache.clear()
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory, ignore_errors=True)
+        self.base = os.path.join(directory, 'ingredients.idx')
+        self.index = IngredientIndex(self.base)
+        Ingredient.objects.create(name='Мука', measurement_unit='г')
+
+    def names(self, text):
+        return [item['name'] for item in self.index.search(text, 10)]
+
+    def test_path_depends_on_database(self):
+        self.assertEqual(self.names('му'), ['Мука'])
+        path = index_path(self.base)
+        self.assertTrue(os.path.exists(path))
+        with mock.patch.dict(connection.settings_dict, NAME='other'):
+            self.assertNotEqual(index_path(self.base), path)
+
+    def test_rebuild_on_catalog_version(self):
+        self.assertEqual(self.names('му'), ['Мука'])
+        with self.captureOnCommitCallbacks(execute=True):
+            Ingredient.objects.create(name='Мускат', measurement_unit='г')
+        self.assertEqual(self.names('му'), ['Мука', 'Мускат'])
+
+
+@override_settings(MEDIA_ROOT=MEDIA_ROOT)
+class FeedTest(RecipeAPITestMixin, TestCase):
+    """Лента: рассылка при публикации, перенос популярных и обрезка."""
+
+    def setUp(self):
+        super().setUp()
+        self.reader = User.objects.create(
+            email='reader@example.com', username='reader',
+            first_name='Читатель', last_name='Тестовый')
+        self.reader_client = make_client(self.reader)
+
+    def publish(self, count=1):
+        self.author.refresh_from_db()
+        return [
+            Recipe.objects.create(
+                author=self.author, name=f'Рецепт {number}', text='Текст',
+                cooking_time=5, image='recipes/images/test.png')
+            for number in range(count)
+        ]
+
+    def subscribe(self):
+        response = self.reader_client.post(
+            f'/api/users/{self.author.pk}/subscribe/')
+        self.assertEqual(response.status_code, 201, response.data)
+
+    def entries(self):
+        return list(FeedEntry.objects.filter(user=self.reader).order_by(
+            '-created', '-recipe_id').values_list('recipe_id', flat=True))
+
+    def feed(self, **params):
+        response = self.reader_client.get('/api/recipes/feed/', params)
+        self.assertEqual(response.status_code, 200)
+        return response.data
+
+    def test_fan_out_on_create(self):
+        self.subscribe()
+        recipe, = self.publish()
+        self.assertEqual(self.entries(), [recipe.pk])
+        self.assertEqual(
+            [item['id'] for item in self.feed()['results']], [recipe.pk])
+
+    @override_settings(FEED_FANOUT_LIMIT=0)
+    def test_pull_popular_author(self):
+        self.subscribe()
+        recipe, = self.publish()
+        self.assertEqual(self.entries(), [])
+        self.assertEqual(
+            [item['id'] for item in self.feed()['results']], [recipe.pk])
+        self.assertEqual(self.entries(), [recipe.pk])
+
+    @override_settings(FEED_MAX_LENGTH=3)
+    def test_trim(self):
+        self.subscribe()
+        recipes = self.publish(5)
+        self.assertEqual(len(self.entries()), 5)
+        self.feed()
+        self.assertEqual(
+            self.entries(), [recipe.pk for recipe in recipes[:1:-1]])
+
+    def test_keyset_order(self):
+        self.subscribe()
+        recipes = self.publish(5)
+        created = recipes[0].created
+        FeedEntry.objects.filter(user=self.reader).update(created=created)
+        expected = sorted(
+            (recipe.pk for recipe in recipes), reverse=True)
+        data = self.feed(limit=2)
+        found = [item['id'] for item in data['results']]
+        while data['next']:
+            response = self.reader_client.get(data['next'])
+            data = response.data
+            found += [item['id'] for item in data['results']]
+        self.assertEqual(found, expected)
+
+    def test_unfollow_cleanup(self):
+        self.subscribe()
+        self.publish(2)
+        response = self.reader_client.delete(
+            f'/api/users/{self.author.pk}/subscribe/')
+        self.assertEqual(response.status_code, 204)
+        self.assertEqual(self.entries(), [])
+        self.assertEqual(self.feed()['results'], [])
+
+    def test_follow_through_model(self):
+        recipe, = self.publish()
+        follow = Follow.objects.create(user=self.reader, following=self.author)
+        self.assertEqual(self.entries(), [recipe.pk])
+        follow.delete()
+        self.assertEqual(self.entries(), [])
+
+
+@override_settings(MEDIA_ROOT=MEDIA_ROOT,
+                   UPLOAD_TEMP_DIR=os.path.join(MEDIA_ROOT, 'uploads'))
+class ImageUploadTest(RecipeAPITestMixin, TestCase):
+    """Загрузка изображения частями и рецепт из загрузки."""
+
+    def setUp(self):
+        super().setUp()
+        self.content = png_bytes()
+        response = self.author_client.post(
+            '/api/uploads/',
+            {'filename': 'photo.png', 'size': len(self.content)},
+            format='json',
+        )
+        self.assertEqual(response.status_code, 201, response.data)
+        self.token = response.data['token']
+        self.url = f'/api/uploads/{self.token}/'
+
+    def send(self, offset, chunk):
+        return self.author_client.generic(
+            'PATCH', self.url, chunk,
+            content_type='application/offset+octet-stream',
+            HTTP_UPLOAD_OFFSET=str(offset),
+        )
+
+    def upload(self):
+        middle = len(self.content) // 2
+        self.assertEqual(self.send(0, self.content[:middle]).status_code, 200)
+        response = self.send(middle, self.content[middle:])
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(response.data['complete'])
+
+    def test_offset_mismatch(self):
+        response = self.send(5, self.content[:5])
+        self.assertEqual(response.status_code, 409)
+        self.assertEqual(response.data['offset'], 0)
+
+    def test_over_limit(self):
+        response = self.send(0, self.content + b'x')
+        self.assertEqual(response.status_code, 413)
+        with override_settings(UPLOAD_CHUNK_SIZE=4):
+            response = self.send(0, self.content[:5])
+        self.assertEqual(response.status_code, 413)
+
+    def test_resume(self):
+        middle = len(self.content) // 2
+        self.send(0, self.content[:middle])
+        self.assertEqual(
+            self.author_client.get(self.url).data['offset'], middle)
+        response = self.send(0, self.content)
+        self.assertEqual(response.status_code, 409)
+        self.assertEqual(response.data['offset'], middle)
+        response = self.send(middle, self.content[middle:])
+        self.assertEqual(response.data['offset'], len(self.content))
+        self.assertTrue(response.data['complete'])
+
+    def test_recipe_from_upload(self):
+        self.upload()
+        path = ImageUpload.objects.get(pk=self.token).path
+        with self.captureOnCommitCallbacks(execute=True):
+            self.create_recipe(
+                ((self.ingredients[0], 100),), image=f'upload:{self.token}')
+        self.assertFalse(ImageUpload.objects.filter(pk=self.token).exists())
+        self.assertFalse(os.path.exists(path))
+
+    def test_incomplete_upload(self):
+        self.send(0, self.content[:5])
+        response = self.author_client.post(
+            '/api/recipes/',
+            self.recipe_data(((self.ingredients[0], 100),),
+                             image=f'upload:{self.token}'),
+            format='json',
+        )
+        self.assertEqual(response.status_code, 400)
+        self.assertIn('image', response.data)
+
+    def test_upload_closed_on_invalid_recipe(self):
+        self.upload()
+        request = mock.Mock(user=self.author)
+        serializer = RecipeWriteSerializer(
+            data=self.recipe_data((), image=f'upload:{self.token}'),
+            context={'request': request},
+        )
+        self.assertFalse(serializer.is_valid())
+        self.assertTrue(serializer.fields['image'].upload_file.closed)
+
+
+@override_settings(MEDIA_ROOT=MEDIA_ROOT)
+class MultipartRecipeTest(RecipeAPITestMixin, TestCase):
+    """Рецепт в multipart с обоими видами вложенных ключей."""
+
+    def post(self, name, key):
+        first, second = self.ingredients[:2]
+        image = io.BytesIO(png_bytes())
+        image.name = 'photo.png'
+        return self.author_client.post('/api/recipes/', {
+            'name': name,
+            'text': 'Смешать и пожарить.',
+            'cooking_time': 30,
+            'tags': self.tags,
+            key.format(0, 'id'): first,
+            key.format(0, 'amount'): 100,
+            key.format(1, 'id'): second,
+            key.format(1, 'amount'): 200,
+            'image': image,
+        }, format='multipart')
+
+    def test_nested_keys(self):
+        for name, key in (('Блины', 'ingredients[{}][{}]'),
+                          ('Оладьи', 'ingredients[{}]{}')):
+            response = self.post(name, key)
+            self.assertEqual(response.status_code, 201, response.data)
+            self.assertEqual(
+                {(item['id'], item['amount'])
+                 for item in response.data['ingredients']},
+                {(self.ingredients[0], 100), (self.ingredients[1], 200)},
+            )
+
+
+@override_settings(MEDIA_ROOT=MEDIA_ROOT)
+class RecipeDuplicateTest(RecipeAPITestMixin, TestCase):
+    """Повтор названия и описания рецепта у одного автора."""
+
+    def test_api_rejects_duplicate(self):
+        self.create_recipe(((self.ingredients[0], 100),))
+        response = self.author_client.post(
+            '/api/recipes/',
+            self.recipe_data(((self.ingredients[1], 50),),
+                             name='  БЛИНЫ ', text='Смешать   и\nпожарить.'),
+            format='json',
+        )
+        self.assertEqual(response.status_code, 400)
+        self.assertIn('non_field_errors', response.data)
+        self.assertEqual(Recipe.objects.count(), 1)
+        other = User.objects.create_user(
+            username='other', email='other@example.com', password='pass')
+        response = make_client(other).post(
+            '/api/recipes/', self.recipe_data(((self.ingredients[1], 50),)),
+            format='json')
+        self.assertEqual(response.status_code, 201, response.data)
+
+    def test_admin_form_rejects_duplicate(self):
+        recipe = self.create_recipe(((self.ingredients[0], 100),))
+        form_class = modelform_factory(
+            Recipe, form=RecipeAdminForm,
+            fields=('author', 'name', 'text', 'cooking_time'))
+        data = {
+            'author': self.author.pk,
+            'name': 'блины',
+            'text': 'Смешать и пожарить.',
+            'cooking_time': 10,
+        }
+        form = form_class(data)
+        self.assertFalse(form.is_valid())
+        self.assertIn('__all__', form.errors)
+        self.assertTrue(form_class(data, instance=recipe).is_valid())
+
+
+@override_settings(MEDIA_ROOT=MEDIA_ROOT)
+class ExportTest(RecipeAPITestMixin, TestCase):
+    """Выгрузка NDJSON и ее повторная загрузка командой load_recipes."""
+
+    def setUp(self):
+        super().setUp()
+        self.user = User.objects.create(
+            email='user@example.com', username='user')
+        self.first = self.create_recipe(
+            ((self.ingredients[0], 200), (self.ingredients[1], 300)),
+            tags=self.tags)
+        self.second = self.create_recipe(
+            ((self.ingredients[3], 2),), name='Омлет', text='Взбить.')
+        Favorite.objects.create(user=self.user, recipe=self.first)
+        ShopingCart.objects.create(user=self.user, recipe=self.second)
+        Follow.objects.create(user=self.user, following=self.author)
+
+    def export(self, sections=('recipes', 'favorites', 'carts', 'follows')):
+        return [json.loads(line) for line in export_lines(sections, 1)]
+
+    def test_records(self):
+        self.assertEqual(self.export(), [
+            {
+                'type': 'recipe',
+                'id': self.first.pk,
+                'author': 'author@example.com',
+                'name': 'Блины',
+                'text': 'Смешать и пожарить.',
+                'cooking_time': 30,
+                'image': self.first.image.name,
+                'created': self.first.created.isoformat(),
+                'tags': ['breakfast', 'dinner'],
+                'ingredients': [
+                    {'name': 'Мука', 'measurement_unit': 'г',
+                     'amount': 200},
+                    {'name': 'Молоко', 'measurement_unit': 'мл',
+                     'amount': 300},
+                ],
+            },
+            {
+                'type': 'recipe',
+                'id': self.second.pk,
+                'author': 'author@example.com',
+                'name': 'Омлет',
+                'text': 'Взбить.',
+                'cooking_time': 30,
+                'image': self.second.image.name,
+                'created': self.second.created.isoformat(),
+                'tags': ['breakfast'],
+                'ingredients': [
+                    {'name': 'Яйца', 'measurement_unit': 'шт', 'amount': 2},
+                ],
+            },
+            {'type': 'favorite', 'user': 'user@example.com',
+             'recipe': self.first.pk},
+            {'type': 'cart', 'user': 'user@example.com',
+             'recipe': self.second.pk},
+            {'type': 'follow', 'user': 'user@example.com',
+             'following': 'author@example.com'},
+        ])
+
+    def test_endpoint(self):
+        url = '/api/recipes/export/?sections=favorites,follows'
+        self.assertEqual(
+            make_client(self.user).get(url).status_code, 403)
+        admin = User.objects.create(
+            email='admin@example.com', username='admin', is_staff=True)
+        response = make_client(admin).get(url)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(
+            b''.join(response.streaming_content).decode(),
+            ''.join(export_lines(('favorites', 'follows'))),
+        )
+        response = make_client(admin).get(
+            '/api/recipes/export/?sections=users')
+        self.assertEqual(response.status_code, 400)
+
+    def test_round_trip(self):
+        records = self.export(('recipes',))
+        path = os.path.join(MEDIA_ROOT, 'export.ndjson')
+        with open(path, 'w', encoding='utf-8') as output:
+            output.writelines(export_lines(('recipes',)))
+        Recipe.objects.all().delete()
+        call_command('load_recipes', path, stdout=io.StringIO())
+        loaded = self.export(('recipes',))
+        for record in records + loaded:
+            del record['id']
+        self.assertEqual(loaded, records)
+        self.assertEqual(
+            User.objects.get(pk=self.author.pk).recipes_count, 2)
+        output = io.StringIO()
+        call_command('load_recipes', path, stdout=output)
+        self.assertIn('уже были: 2', output.getvalue())
+        self.assertEqual(Recipe.objects.count(), 2)
+
+
+@skipUnless(connection.vendor == 'postgresql',
+            'Снимок базы для выгрузки берется только на PostgreSQL.')
+@override_settings(MEDIA_ROOT=MEDIA_ROOT)
+class ExportSnapshotTest(RecipeAPITestMixin, TransactionTestCase):
+    """Записи, зафиксированные во время выгрузки, в нее не попадают."""
+
+    def test_snapshot(self):
+        recipe = self.create_recipe(((self.ingredients[0], 100),))
+        user = User.objects.create(email='user@example.com', username='user')
+        lines = export_lines(('recipes', 'favorites'), 1)
+        first = json.loads(next(lines))
+
+        def add_favorite():
+            try:
+                Favorite.objects.create(user=user, recipe=recipe)
+            finally:
+                connection.close()
+
+        worker = threading.Thread(target=add_favorite)
+        worker.start()
+        worker.join()
+        self.assertEqual(first['id'], recipe.pk)
+        self.assertEqual(list(lines), [])
+        self.assertEqual(
+            [json.loads(line)['type']
+             for line in export_lines(('favorites',))],
+            ['favorite'],
+        )
+
+
+@override_settings(MEDIA_ROOT=MEDIA_ROOT)
+class CursorPaginationTest(RecipeAPITestMixin, TransactionTestCase):
+    """Курсорные страницы не сдвигаются от записей между запросами."""
+
+    def setUp(self):
+        super().setUp()
+        self.recipes = [
+            self.create_recipe(
+                ((self.ingredients[0], 100),), name=f'Рецепт {number}').pk
+            for number in range(7)
+        ]
+        self.recipes.reverse()
+
+    def walk(self, url, between):
+        """id рецептов всех страниц, between вызывается после первой."""
+        found = []
+        while url is not None:
+            response = self.client.get(url)
+            self.assertEqual(response.status_code, 200)
+            self.assertNotIn('count', response.data)
+            found.extend(recipe['id'] for recipe in response.data['results'])
+            url = response.data['next']
+            if between is not None:
+                between()
+                between = None
+        return found
+
+    def test_insert_between_pages(self):
+        found = self.walk(
+            '/api/recipes/?cursor=&limit=3',
+            lambda: self.create_recipe(
+                ((self.ingredients[1], 50),), name='Новый'))
+        self.assertEqual(found, self.recipes)
+
+    def test_delete_between_pages(self):
+        found = self.walk(
+            '/api/recipes/?cursor=&limit=3',
+            lambda: Recipe.objects.filter(pk=self.recipes[1]).delete())
+        self.assertEqual(found, self.recipes)
+
+    def test_previous_page(self):
+        first = self.client.get('/api/recipes/?cursor=&limit=3').data
+        second = self.client.get(first['next']).data
+        self.create_recipe(((self.ingredients[1], 50),), name='Новый')
+        back = self.client.get(second['previous']).data
+        self.assertEqual(back['results'], first['results'])
+
+
+@override_settings(MEDIA_ROOT=MEDIA_ROOT)
+class ConditionalGetTest(RecipeAPITestMixin, TransactionTestCase):
+    """304 на повторный запрос и 200 после зафиксированной записи."""
+
+    def setUp(self):
+        super().setUp()
+        self.recipe = self.create_recipe(((self.ingredients[0], 100),))
+        self.user = User.objects.create(
+            email='user@example.com', username='user')
+        self.user_client = make_client(self.user)
+
+    def assertChanged(self, client, url, write):
+        """После write ответ на запрос с прежним ETag — 200."""
+        response = client.get(url)
+        self.assertEqual(response.status_code, 200)
+        etag = response['ETag']
+        response = client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 304)
+        self.assertEqual(response['ETag'], etag)
+        write()
+        response = client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertNotEqual(response['ETag'], etag)
+
+    def test_list_after_update(self):
+        self.assertChanged(
+            self.client, '/api/recipes/',
+            lambda: self.author_client.patch(
+                f'/api/recipes/{self.recipe.pk}/',
+                self.recipe_data(((self.ingredients[1], 50),)),
+                format='json'))
+
+    def test_list_after_delete(self):
+        self.create_recipe(((self.ingredients[1], 50),), name='Омлет')
+        self.assertChanged(
+            self.client, '/api/recipes/',
+            lambda: self.author_client.delete(
+                f'/api/recipes/{self.recipe.pk}/'))
+
+    def test_detail_after_favorite(self):
+        url = f'/api/recipes/{self.recipe.pk}/'
+        self.assertChanged(
+            self.user_client, url,
+            lambda: self.user_client.post(f'{url}favorite/'))
+
+    def test_detail_after_tag_change(self):
+        tag = Tag.objects.get(pk=self.tags[0])
+        tag.name = 'Поздний завтрак'
+        self.assertChanged(
+            self.client, f'/api/recipes/{self.recipe.pk}/', tag.save)
+
+
+class LoadDataTest(TestCase):
+    """Повторная загрузка справочника ингредиентов."""
+
+    def setUp(self):
+        cache.clear()
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory, ignore_errors=True)
+        patcher = mock.patch.object(
+            ingredient_index, 'path', os.path.join(directory, 'index.idx'))
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        Ingredient.objects.create(name='Мука', measurement_unit='г')
+        self.csv_path = os.path.join(directory, 'ingredients.csv')
+        with open(self.csv_path, 'w', encoding='utf-8') as file:
+            file.write('Мука,г\nМолоко,мл\nСоль,г\nМолоко,мл\n')
+        self.json_path = os.path.join(directory, 'ingredients.json')
+        with open(self.json_path, 'w', encoding='utf-8') as file:
+            json.dump([{'name': 'Соль', 'measurement_unit': 'г'},
+                       {'name': 'Яйца', 'measurement_unit': 'шт'}],
+                      file, ensure_ascii=False)
+
+    def load(self, *args):
+        stdout, stderr = io.StringIO(), io.StringIO()
+        with self.captureOnCommitCallbacks(execute=True):
+            call_command('load_data', *args, stdout=stdout, stderr=stderr)
+        return stdout.getvalue(), stderr.getvalue()
+
+    def catalog(self):
+        return sorted(Ingredient.objects.values_list(
+            'name', 'measurement_unit'))
+
+    @override_settings(CACHES={'default': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'}})
+    def test_load_twice(self):
+        stdout, stderr = self.load('csv', '--path', self.csv_path)
+        self.assertIn('Добавлено ингредиентов: 2', stdout)
+        self.assertIn('перезапустите сервер', stderr)
+        catalog = self.catalog()
+        self.assertEqual(catalog, [
+            ('Молоко', 'мл'), ('Мука', 'г'), ('Соль', 'г')])
+        stdout, stderr = self.load('csv', '--path', self.csv_path)
+        self.assertIn('Добавлено ингредиентов: 0', stdout)
+        self.assertEqual(stderr, '')
+        self.assertEqual(self.catalog(), catalog)
+        self.load('json', '--path', self.json_path)
+        self.load('json', '--path', self.json_path)
+        self.assertEqual(self.catalog(), catalog + [('Яйца', 'шт')])
+        self.assertEqual(
+            [item['name'] for item in ingredient_index.search('я', 10)],
+            ['Яйца'])
+
+    @override_settings(CACHES={'default': {
+        'BACKEND': 'django.core.cache.backends.dummy.DummyCache'}})
+    def test_shared_cache_without_warning(self):
+        stdout, stderr = self.load('csv', '--path', self.csv_path)
+        self.assertIn('Добавлено ингредиентов: 2', stdout)
+        self.assertEqual(stderr, '')
+
+    def test_dry_run(self):
+        stdout, _ = self.load('csv', '--path', self.csv_path, '--dry-run')
+        self.assertIn('Будет добавлено ингредиентов: 2', stdout)
+        self.assertEqual(self.catalog(), [('Мука', 'г')])
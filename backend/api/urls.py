@@ -2,6 +2,7 @@ from django.urls import include, path
 from rest_framework import routers
 
 from .views import (
+    ImageUploadViewSet,
     IngredientViewSet,
     TagViewSet,
     UserCustomViewSet,
@@ -17,6 +18,8 @@ router_recipe_v1.register(
     'ingredients', IngredientViewSet, basename='ingredient')
 router_recipe_v1.register('tags', TagViewSet, basename='tag')
 router_recipe_v1.register('recipes', RecipeViewSet, basename='recipe')
+router_recipe_v1.register(
+    'uploads', ImageUploadViewSet, basename='image-upload')
 
 urlpatterns = [
     path('', include(router_recipe_v1.urls)),
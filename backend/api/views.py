@@ -1,25 +1,33 @@
-import io
+import os
+from hashlib import md5
 
-from django.http import FileResponse
+from django.conf import settings
+from django.http import FileResponse, StreamingHttpResponse
 from django_filters.rest_framework import DjangoFilterBackend
-from rest_framework.permissions import IsAuthenticated
-from rest_framework.viewsets import ModelViewSet
+from rest_framework.permissions import IsAdminUser, IsAuthenticated
+from rest_framework import mixins, status
+from rest_framework.parsers import FormParser, JSONParser, MultiPartParser
+from rest_framework.viewsets import GenericViewSet, ModelViewSet
 from django.contrib.auth import get_user_model
 from rest_framework.response import Response
 from rest_framework.decorators import action
-from django.shortcuts import get_object_or_404
-from django.db.models import Sum
+from django.db import transaction
+from django.db.models import Count, Max
 from django.db.models import Exists, OuterRef
 from djoser.views import UserViewSet
 
 from users.models import Follow
+from recipes.export import SECTIONS, export_lines
+from recipes.feed import refresh_feed
 from recipes.models import (
     Ingredient,
     Tag,
     Recipe,
     Favorite,
+    FeedEntry,
+    ImageUpload,
     ShopingCart,
-    IngredientInRecipe,
+    ShoppingListItem,
 )
 from .permissions import IsAuthorOrAdminOrReadOnly
 from .serializers import (
@@ -28,10 +36,27 @@ from .serializers import (
     RecipeReadSerializer,
     RecipeWriteSerializer,
     FollowSerializer,
+    ImageUploadSerializer,
+    ShoppingListItemSerializer,
 )
 from .filters import RecipeFilter, IngredientFilter
-from .mixins import TagIngredientMixin
-from .intermediate import del_intermediate_obj, add_intermediate_obj
+from .mixins import ConditionalGetMixin, TagIngredientMixin
+from .pagination import CustomPagination, KeysetPagination
+from .intermediate import (
+    add_intermediate_obj,
+    bulk_intermediate_obj,
+    del_intermediate_obj,
+)
+from .ingredient_index import ingredient_index
+from .catalog import CatalogMap, catalog_payload
+from .renderers import (
+    CSVRenderer,
+    FileContentNegotiation,
+    PDFRenderer,
+    PlainTextRenderer,
+)
+from .shopping_list import FORMATS, chunked, pdf_file
+from .cache import CATALOG_VERSION_KEY, get_user_recipe_ids, get_versions
 
 User = get_user_model()
 
@@ -43,6 +68,20 @@ class IngredientViewSet(TagIngredientMixin):
     serializer_class = IngredientSerializer
     filter_backends = (DjangoFilterBackend,)
     filterset_class = IngredientFilter
+    catalog = CatalogMap(Ingredient, catalog_payload(IngredientSerializer))
+
+    def list(self, request, *args, **kwargs):
+        """Автодополнение по названию обслуживается индексом в памяти."""
+        name = request.query_params.get('name')
+        if not name:
+            return super().list(request, *args, **kwargs)
+        try:
+            limit = int(request.query_params.get(
+                'limit', settings.INGREDIENT_SEARCH_LIMIT))
+        except ValueError:
+            limit = settings.INGREDIENT_SEARCH_LIMIT
+        return Response(ingredient_index.search(
+            name, min(max(limit, 1), settings.INGREDIENT_SEARCH_LIMIT)))
 
 
 class TagViewSet(TagIngredientMixin):
@@ -50,13 +89,15 @@ class TagViewSet(TagIngredientMixin):
 
     queryset = Tag.objects.all()
     serializer_class = TagSerializer
+    catalog = CatalogMap(Tag, catalog_payload(TagSerializer))
 
 
-class RecipeViewSet(ModelViewSet):
+class RecipeViewSet(ConditionalGetMixin, ModelViewSet):
     """Вывод рецептов и корзины покупок."""
 
     serializer_class = RecipeReadSerializer
     permission_classes = (IsAuthorOrAdminOrReadOnly,)
+    parser_classes = (JSONParser, MultiPartParser, FormParser)
     filter_backends = (DjangoFilterBackend,)
     filterset_class = RecipeFilter
 
@@ -66,19 +107,52 @@ class RecipeViewSet(ModelViewSet):
         return RecipeReadSerializer
 
     def get_queryset(self):
-        if not self.request.user.is_authenticated:
-            return Recipe.objects.all()
-        return Recipe.objects.select_related(
-            'author').prefetch_related(
-            'tags', 'recipeingredients__ingredient').annotate(
-            is_favorited=Exists(Favorite.objects.filter(
-                recipe=OuterRef('pk'),
-                user=self.request.user,
-            )),
-            is_in_shopping_cart=Exists(ShopingCart.objects.filter(
-                recipe=OuterRef('pk'),
-                user=self.request.user,
-            ))
+        """Единый queryset для анонимных и авторизованных пользователей.
+
+        Теги и ингредиенты подгружает сериализатор одним запросом на
+        страницу и только для рецептов, которых нет в кэше, а флаги
+        пользователя он вычисляет по закэшированным множествам id,
+        поэтому стоимость списка не зависит от размера страницы.
+        """
+        return Recipe.objects.select_related('author')
+
+    def get_user_validators(self, recipe_pk=None):
+        """Части ETag, зависящие от версии справочников и пользователя."""
+        parts = [get_versions({CATALOG_VERSION_KEY})[CATALOG_VERSION_KEY]]
+        if self.request.user.is_authenticated:
+            for field, ids in get_user_recipe_ids(self.request.user).items():
+                if recipe_pk is not None:
+                    parts.append(recipe_pk in ids)
+                else:
+                    parts.append(md5(
+                        str(sorted(ids)).encode()).hexdigest())
+        return parts
+
+    def get_list_validators(self):
+        """ETag списка по числу рецептов и последнему изменению.
+
+        В курсорном режиме не считается: агрегат по всей выборке
+        свел бы на нет отказ от COUNT.
+        """
+        if CustomPagination.cursor_query_param in self.request.query_params:
+            return None
+        stats = self.filter_queryset(self.get_queryset()).aggregate(
+            last_modified=Max('updated'), count=Count('id'))
+        return (
+            (stats['last_modified'], stats['count'],
+             *self.get_user_validators()),
+            stats['last_modified'],
+        )
+
+    def get_detail_validators(self):
+        try:
+            recipe = Recipe.objects.filter(
+                pk=self.kwargs['pk']).values('pk', 'updated').get()
+        except (Recipe.DoesNotExist, TypeError, ValueError):
+            return None
+        return (
+            (recipe['updated'], *self.get_user_validators(recipe['pk'])),
+            recipe['updated'],
         )
 
     def add_or_del_recipe(self, request, pk, model):
@@ -86,7 +160,6 @@ class RecipeViewSet(ModelViewSet):
         if request.method == 'POST':
             return add_intermediate_obj(request, pk, model)
         if request.method == 'DELETE':
-            get_object_or_404(Recipe, pk=pk)
             return del_intermediate_obj(request, pk, model)
 
     @action(
@@ -111,39 +184,130 @@ class RecipeViewSet(ModelViewSet):
             request, pk, ShopingCart
         )
 
+    @action(
+        detail=False,
+        methods=('post', 'delete'),
+        url_path='bulk_favorite',
+        permission_classes=(IsAuthenticated,)
+    )
+    def bulk_favorite(self, request):
+        """Пакетное добавление и удаление рецептов в избранном."""
+        return bulk_intermediate_obj(request, Favorite)
+
+    @action(
+        detail=False,
+        methods=('post', 'delete'),
+        url_path='bulk_shopping_cart',
+        permission_classes=(IsAuthenticated,)
+    )
+    def bulk_shopping_cart(self, request):
+        """Пакетное добавление и удаление рецептов в списке покупок."""
+        return bulk_intermediate_obj(request, ShopingCart)
+
     @action(
         detail=False,
         methods=('get',),
-        url_path='download_shopping_cart',
+        url_path='feed',
+        permission_classes=(IsAuthenticated,)
+    )
+    def feed(self, request):
+        """Лента рецептов авторов из подписок, только по курсору."""
+        if not request.query_params.get(KeysetPagination.cursor_query_param):
+            refresh_feed(request.user)
+        paginator = KeysetPagination(
+            self.paginator.get_page_size(request), ('-created', '-recipe_id'))
+        page = paginator.paginate_queryset(
+            FeedEntry.objects.filter(user=request.user).select_related(
+                'recipe__author'),
+            request,
+            self,
+        )
+        serializer = self.get_serializer(
+            [entry.recipe for entry in page], many=True)
+        return paginator.get_paginated_response(serializer.data)
+
+    @action(
+        detail=False,
+        methods=('get',),
+        url_path='shopping_list',
         permission_classes=(IsAuthenticated,)
     )
+    def shopping_list(self, request):
+        """Список покупок: суммы ингредиентов по рецептам в корзине."""
+        items = ShoppingListItem.objects.filter(
+            user=request.user).select_related('ingredient').order_by(
+            'ingredient__name')
+        return Response(ShoppingListItemSerializer(items, many=True).data)
+
+    @action(
+        detail=False,
+        methods=('get',),
+        permission_classes=(IsAdminUser,),
+    )
+    def export(self, request):
+        """Выгрузка рецептов, избранного, корзин и подписок в NDJSON.
+
+        Разделы перечисляются в параметре sections через запятую.
+        """
+        sections = request.query_params.get('sections')
+        sections = sections.split(',') if sections else tuple(SECTIONS)
+        unknown = set(sections) - SECTIONS.keys()
+        if unknown:
+            return Response(
+                {'errors': f'Неизвестные разделы: {", ".join(unknown)}.'},
+                status=status.HTTP_400_BAD_REQUEST,
+            )
+        response = StreamingHttpResponse(
+            chunked(export_lines(sections)),
+            content_type='application/x-ndjson; charset=utf-8',
+        )
+        response['Content-Disposition'] = (
+            'attachment; filename="export.ndjson"')
+        return response
+
+    @action(
+        detail=False,
+        methods=('get',),
+        url_path='download_shopping_cart',
+        permission_classes=(IsAuthenticated,),
+        renderer_classes=(PlainTextRenderer, CSVRenderer, PDFRenderer),
+        content_negotiation_class=FileContentNegotiation,
+    )
     def download_shopping_cart(self, request):
-        """Формирует список покупок и возвращает txt файл в ответе."""
-        shopping_cart = IngredientInRecipe.objects.filter(
-            recipe__shopingcart__user=self.request.user).values(
-            'ingredient__name', 'ingredient__measurement_unit').annotate(
-            Sum('amount'))
-        out = io.StringIO()
-        out.write('Список покупок:''\n')
-        for row in list(shopping_cart):
-            ingredient = row.get('ingredient__name').capitalize()
-            measurement_unit = row.get('ingredient__measurement_unit')
-            amount = row.get('amount__sum')
-            out.write(f'\n{ingredient}({measurement_unit}) - {amount}')
-        content = out.getvalue()
-        out.close()
-        return FileResponse(
-            content,
-            headers={
-                'Content-Type': 'text/plain',
-                'Content-Disposition': 'attachment;'
-                                       'filename="shopping_cart.txt"',
-            }
+        """Выгружает список покупок в формате txt, csv или pdf.
+
+        Формат задается параметром format, по умолчанию txt.
+        """
+        file_format = request.accepted_renderer.format
+        rows = ShoppingListItem.objects.filter(
+            user=request.user).values_list(
+            'ingredient__name', 'ingredient__measurement_unit', 'amount'
+        ).order_by('ingredient__name').iterator(
+            chunk_size=settings.SHOPPING_LIST_CHUNK_SIZE)
+        filename = f'shopping_cart.{file_format}'
+        if file_format == 'pdf':
+            output, size = pdf_file(rows)
+            response = FileResponse(
+                output,
+                as_attachment=True,
+                filename=filename,
+                content_type=request.accepted_media_type,
+            )
+            response['Content-Length'] = size
+            return response
+        response = StreamingHttpResponse(
+            chunked(FORMATS[file_format](rows)),
+            content_type=f'{request.accepted_media_type}; charset=utf-8',
         )
+        response['Content-Disposition'] = (
+            f'attachment; filename="{filename}"')
+        return response
 
 
 class UserCustomViewSet(UserViewSet):
 
+    cursor_ordering = ('id',)
+
     def get_queryset(self):
         if not self.request.user.is_authenticated:
             return User.objects.all()
@@ -154,12 +318,12 @@ class UserCustomViewSet(UserViewSet):
             )))
 
     def get_followings(self, request):
-        return User.objects.prefetch_related(
-            'recipes').annotate(
+        """Рецепты авторов страницы выбирает сериализатор."""
+        return User.objects.annotate(
             is_subscribed=Exists(Follow.objects.filter(
                 following=OuterRef('pk'),
                 user=request.user
-            )))
+            ))).order_by('id')
 
     @action(
         detail=False,
@@ -201,7 +365,100 @@ class UserCustomViewSet(UserViewSet):
         permission_classes=(IsAuthenticated,),
     )
     def subscribe(self, request, id):
-        get_object_or_404(User, pk=id)
         if request.method == 'POST':
             return add_intermediate_obj(request, id, Follow)
         return del_intermediate_obj(request, id, Follow)
+
+    @action(
+        detail=False,
+        methods=('post', 'delete'),
+        url_path='bulk_subscribe',
+        permission_classes=(IsAuthenticated,),
+    )
+    def bulk_subscribe(self, request):
+        """Пакетная подписка на авторов и отписка от них."""
+        return bulk_intermediate_obj(request, Follow)
+
+
+class ImageUploadViewSet(mixins.CreateModelMixin,
+                         mixins.RetrieveModelMixin,
+                         mixins.DestroyModelMixin,
+                         GenericViewSet):
+    """Загрузка изображения частями с продолжением после обрыва.
+
+    PATCH принимает очередную часть в теле запроса, ее начало передается
+    в заголовке Upload-Offset и должно совпадать с числом принятых байт.
+    """
+
+    serializer_class = ImageUploadSerializer
+    permission_classes = (IsAuthenticated,)
+    http_method_names = ('get', 'post', 'patch', 'delete', 'head', 'options')
+    block_size = 64 * 1024
+
+    def get_queryset(self):
+        return ImageUpload.objects.filter(user=self.request.user)
+
+    def perform_create(self, serializer):
+        serializer.save(user=self.request.user)
+
+    def perform_destroy(self, upload):
+        upload.discard()
+
+    def create(self, request, *args, **kwargs):
+        response = super().create(request, *args, **kwargs)
+        response.data['chunk_size'] = settings.UPLOAD_CHUNK_SIZE
+        return response
+
+    def partial_update(self, request, *args, **kwargs):
+        try:
+            offset = int(request.headers['Upload-Offset'])
+            length = int(request.headers['Content-Length'])
+        except (KeyError, ValueError):
+            return Response(
+                {'errors': 'Нужны заголовки Upload-Offset и Content-Length.'},
+                status=status.HTTP_400_BAD_REQUEST,
+            )
+        with transaction.atomic():
+            upload = self.get_queryset().select_for_update().filter(
+                pk=kwargs['pk']).first()
+            if upload is None:
+                return Response(status=status.HTTP_404_NOT_FOUND)
+            received = upload.received
+            if offset != received:
+                return Response(
+                    {'errors': 'Неверное смещение части.', 'offset': received},
+                    status=status.HTTP_409_CONFLICT,
+                )
+            if (length > settings.UPLOAD_CHUNK_SIZE
+                    or received + length > upload.size):
+                return Response(
+                    {'errors': 'Часть больше допустимого размера.',
+                     'offset': received},
+                    status=status.HTTP_413_REQUEST_ENTITY_TOO_LARGE,
+                )
+            if not self.write_chunk(upload, request.stream, length):
+                return Response(
+                    {'errors': 'Часть передана не полностью.',
+                     'offset': received},
+                    status=status.HTTP_400_BAD_REQUEST,
+                )
+        return Response(self.get_serializer(upload).data)
+
+    def write_chunk(self, upload, stream, length):
+        """Дописывает часть блоками, при обрыве принятое отбрасывается."""
+        os.makedirs(settings.UPLOAD_TEMP_DIR, exist_ok=True)
+        with open(upload.path, 'ab') as part:
+            start = part.tell()
+            try:
+                while length > 0:
+                    block = stream.read(min(self.block_size, length))
+                    if not block:
+                        break
+                    part.write(block)
+                    length -= len(block)
+            except BaseException:
+                part.truncate(start)
+                raise
+            if length:
+                part.truncate(start)
+        return not length
@@ -1,4 +1,5 @@
 import os
+import tempfile
 from pathlib import Path
 
 from dotenv import load_dotenv
@@ -70,6 +71,53 @@ DATABASES = {
     }
 }
 
+CACHES = {
+    'default': {
+        'BACKEND': os.getenv(
+            'CACHE_BACKEND', 'django.core.cache.backends.locmem.LocMemCache'),
+        'LOCATION': os.getenv('CACHE_LOCATION', ''),
+    }
+}
+
+RECIPE_CACHE_TIMEOUT = int(os.getenv('RECIPE_CACHE_TIMEOUT', 60 * 60 * 24))
+
+SEARCH_CONFIG = 'russian'
+
+# Префикс файла индекса, к нему добавляется имя базы данных.
+INGREDIENT_INDEX_PATH = os.getenv(
+    'INGREDIENT_INDEX_PATH',
+    os.path.join(tempfile.gettempdir(), 'foodgram-ingredients.idx'),
+)
+INGREDIENT_SEARCH_LIMIT = 50
+
+CATALOG_MAX_AGE = int(os.getenv('CATALOG_MAX_AGE', 60 * 60))
+
+SHOPPING_LIST_CHUNK_SIZE = 2000
+EXPORT_CHUNK_SIZE = 5000
+SHOPPING_LIST_SPOOL_SIZE = 1024 * 1024
+SHOPPING_LIST_PDF_FONT = os.getenv(
+    'SHOPPING_LIST_PDF_FONT',
+    '/usr/share/fonts/truetype/dejavu/DejaVuSans.ttf',
+)
+
+BULK_MAX_IDS = 500
+
+FEED_MAX_LENGTH = 500
+
+IMAGE_PROCESSING_WORKERS = int(os.getenv('IMAGE_PROCESSING_WORKERS', 2))
+FEED_FANOUT_LIMIT = int(os.getenv('FEED_FANOUT_LIMIT', 1000))
+
+FILE_UPLOAD_HANDLERS = (
+    'django.core.files.uploadhandler.TemporaryFileUploadHandler',
+)
+UPLOAD_TEMP_DIR = os.getenv(
+    'UPLOAD_TEMP_DIR',
+    os.path.join(tempfile.gettempdir(), 'foodgram-uploads'),
+)
+UPLOAD_CHUNK_SIZE = 1024 * 1024
+UPLOAD_MAX_SIZE = 20 * 1024 * 1024
+UPLOAD_EXPIRY_HOURS = 24
+
 AUTH_PASSWORD_VALIDATORS = [
     {
         'NAME': 'django.contrib.auth.password_validation.UserAttributeSimilarityValidator',
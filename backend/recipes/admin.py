@@ -1,3 +1,4 @@
+from django import forms
 from django.contrib import admin
 
 from .models import (
@@ -6,7 +7,9 @@ from .models import (
     Tag,
     Favorite,
     ShopingCart,
-    IngredientInRecipe
+    ShoppingListItem,
+    IngredientInRecipe,
+    recipe_digest,
 )
 
 
@@ -19,12 +22,38 @@ class IngredientInRecipeInline(admin.TabularInline):
     )
 
 
+class RecipeAdminForm(forms.ModelForm):
+
+    def clean(self):
+        """Повтор рецепта автора.
+
+        digest не редактируется в форме, поэтому проверка уникальности
+        модели его пропускает и повтор дошел бы до индекса базы.
+        """
+        cleaned_data = super().clean()
+        author = cleaned_data.get('author')
+        name = cleaned_data.get('name')
+        text = cleaned_data.get('text')
+        if author is None or name is None or text is None:
+            return cleaned_data
+        duplicates = Recipe.objects.filter(
+            author=author, digest=recipe_digest(name, text))
+        if self.instance.pk is not None:
+            duplicates = duplicates.exclude(pk=self.instance.pk)
+        if duplicates.exists():
+            raise forms.ValidationError(
+                'У автора уже есть рецепт с таким названием и описанием!')
+        return cleaned_data
+
+
 @admin.register(Recipe)
 class RecipeAdmin(admin.ModelAdmin):
+    form = RecipeAdminForm
     list_display = (
         'id',
         'name',
         'author',
+        'favorites_count',
     )
     list_display_links = ('name',)
     list_filter = (
@@ -47,15 +76,11 @@ class RecipeAdmin(admin.ModelAdmin):
         'cooking_time',
         'text',
         'image',
-        'favorite_count'
+        'favorites_count'
     )
-    readonly_fields = ('id', 'favorite_count', 'created',)
+    readonly_fields = ('id', 'favorites_count', 'created',)
     inlines = (IngredientInRecipeInline,)
 
-    def favorite_count(self, instance):
-        return instance.favorite_set.count()
-    favorite_count.short_description = 'Добавлено в избранное(количество)'
-
 
 class FavoriteInline(admin.TabularInline):
     model = Favorite
@@ -108,3 +133,8 @@ class FavoriteAdmin(admin.ModelAdmin):
 @admin.register(ShopingCart)
 class ShopingCartAdmin(admin.ModelAdmin):
     list_display = ('id', 'user', 'recipe',)
+
+
+@admin.register(ShoppingListItem)
+class ShoppingListItemAdmin(admin.ModelAdmin):
+    list_display = ('id', 'user', 'ingredient', 'amount',)
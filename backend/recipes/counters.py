@@ -0,0 +1,58 @@
+"""Счетчики рецептов, избранного и подписчиков.
+
+Счетчики меняются приращениями F() в той же транзакции, что и связи,
+и не опускаются ниже нуля. Расхождения находит и исправляет команда
+recount_counters.
+"""
+from django.contrib.auth import get_user_model
+from django.db.models import Count, F, OuterRef, Subquery, Value
+from django.db.models.functions import Coalesce, Greatest
+
+from users.models import Follow
+from .models import Favorite, Recipe
+
+User = get_user_model()
+
+COUNTERS = {
+    User: {
+        'recipes_count': (Recipe, 'author'),
+        'followers_count': (Follow, 'following'),
+    },
+    Recipe: {
+        'favorites_count': (Favorite, 'recipe'),
+    },
+}
+
+
+def change_counter(model, field, ids, delta):
+    """Прибавляет delta к счетчику field объектов с id из ids."""
+    if not delta:
+        return
+    value = F(field) + delta
+    if delta < 0:
+        value = Greatest(value, 0)
+    model.objects.filter(pk__in=ids).update(**{field: value})
+
+
+def change_recipes_count(author_id, delta):
+    change_counter(User, 'recipes_count', (author_id,), delta)
+
+
+def change_followers_count(user_ids, delta):
+    change_counter(User, 'followers_count', user_ids, delta)
+
+
+def change_favorites_count(recipe_ids, delta):
+    change_counter(Recipe, 'favorites_count', recipe_ids, delta)
+
+
+def actual_counts(model):
+    """Значения счетчиков модели, посчитанные подзапросами."""
+    return {
+        field: Coalesce(Subquery(
+            related.objects.filter(**{relation: OuterRef('pk')})
+            .order_by().values(relation).annotate(count=Count('pk'))
+            .values('count')
+        ), Value(0))
+        for field, (related, relation) in COUNTERS[model].items()
+    }
@@ -0,0 +1,100 @@
+"""Выгрузка рецептов и коллекций пользователей в NDJSON.
+
+Каждая таблица читается одним проходом серверного курсора
+в порядке id рецепта, теги и ингредиенты присоединяются к рецептам
+слиянием упорядоченных потоков, поэтому память не зависит от объема
+выгрузки. Строки рецептов подходят для команды load_recipes.
+"""
+import json
+from itertools import groupby
+from operator import itemgetter
+
+from django.conf import settings
+from django.db import connection, transaction
+
+from users.models import Follow
+from .models import Favorite, IngredientInRecipe, Recipe, ShopingCart
+
+
+def children(rows):
+    """Возвращает функцию, отдающую строки с первым полем, равным id.
+
+    rows упорядочены по первому полю, id запрашиваются по возрастанию.
+    """
+    groups = groupby(rows, key=itemgetter(0))
+    current = next(groups, None)
+
+    def take(pk):
+        nonlocal current
+        while current is not None and current[0] < pk:
+            current = next(groups, None)
+        if current is None or current[0] != pk:
+            return []
+        found = [row[1:] for row in current[1]]
+        current = next(groups, None)
+        return found
+    return take
+
+
+def recipe_records(chunk_size):
+    tags = children(Recipe.tags.through.objects.order_by(
+        'recipe_id', 'tag_id').values_list(
+        'recipe_id', 'tag__slug').iterator(chunk_size))
+    ingredients = children(IngredientInRecipe.objects.order_by(
+        'recipe_id', 'pk').values_list(
+        'recipe_id', 'ingredient__name', 'ingredient__measurement_unit',
+        'amount').iterator(chunk_size))
+    for pk, author, name, text, cooking_time, image, created in (
+            Recipe.objects.order_by('pk').values_list(
+                'pk', 'author__email', 'name', 'text', 'cooking_time',
+                'image', 'created').iterator(chunk_size)):
+        yield {
+            'type': 'recipe',
+            'id': pk,
+            'author': author,
+            'name': name,
+            'text': text,
+            'cooking_time': cooking_time,
+            'image': image,
+            'created': created.isoformat(),
+            'tags': [slug for slug, in tags(pk)],
+            'ingredients': [
+                {'name': title, 'measurement_unit': unit, 'amount': amount}
+                for title, unit, amount in ingredients(pk)
+            ],
+        }
+
+
+def link_records(record_type, model, fields):
+    def records(chunk_size):
+        for user, target in model.objects.order_by('pk').values_list(
+                'user__email', fields[1]).iterator(chunk_size):
+            yield {'type': record_type, 'user': user, fields[0]: target}
+    return records
+
+
+SECTIONS = {
+    'recipes': recipe_records,
+    'favorites': link_records('favorite', Favorite, ('recipe', 'recipe_id')),
+    'carts': link_records('cart', ShopingCart, ('recipe', 'recipe_id')),
+    'follows': link_records(
+        'follow', Follow, ('following', 'following__email')),
+}
+
+
+def export_lines(sections=tuple(SECTIONS), chunk_size=None):
+    """Строки NDJSON выбранных разделов.
+
+    На PostgreSQL все разделы читаются из одного снимка базы.
+    """
+    chunk_size = chunk_size or settings.EXPORT_CHUNK_SIZE
+    snapshot = (connection.vendor == 'postgresql'
+                and not connection.in_atomic_block)
+    with transaction.atomic():
+        if snapshot:
+            with connection.cursor() as cursor:
+                cursor.execute('SET TRANSACTION ISOLATION LEVEL '
+                               'REPEATABLE READ READ ONLY')
+        for section in sections:
+            for record in SECTIONS[section](chunk_size):
+                yield json.dumps(record, ensure_ascii=False) + '\n'
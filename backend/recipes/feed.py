@@ -0,0 +1,118 @@
+"""Лента рецептов авторов, на которых подписан пользователь.
+
+Рецепт автора, у которого не больше FEED_FANOUT_LIMIT подписчиков,
+записывается в ленты подписчиков при публикации. Новые рецепты
+популярных авторов переносятся в ленту при ее чтении, поэтому стоимость
+публикации ограничена, а лента всегда читается по индексу таблицы
+FeedEntry независимо от числа подписок.
+"""
+from datetime import timedelta
+
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.core.cache import cache
+from django.db.models import Q
+from django.utils import timezone
+
+from users.models import Follow
+from .models import FeedEntry, Recipe
+
+User = get_user_model()
+
+FEED_PULLED_KEY = 'feed-pulled:{}'
+FEED_PULL_OVERLAP = timedelta(minutes=5)
+
+
+def add_entries(user_ids, recipes):
+    """Добавляет пары (пользователь, рецепт) в ленты, пропуская дубли."""
+    FeedEntry.objects.bulk_create(
+        (FeedEntry(user_id=user_id, recipe_id=pk, created=created)
+         for user_id in user_ids for pk, created in recipes),
+        batch_size=1000,
+        ignore_conflicts=True,
+    )
+
+
+def fan_out(recipe):
+    """Записывает новый рецепт в ленты подписчиков автора."""
+    if recipe.author.followers_count > settings.FEED_FANOUT_LIMIT:
+        return
+    add_entries(
+        Follow.objects.filter(following_id=recipe.author_id).values_list(
+            'user_id', flat=True).iterator(),
+        ((recipe.pk, recipe.created),),
+    )
+
+
+def fan_out_many(recipes):
+    """Записывает пачку новых рецептов в ленты подписчиков авторов."""
+    by_author = {}
+    for recipe in recipes:
+        by_author.setdefault(recipe.author_id, []).append(
+            (recipe.pk, recipe.created))
+    followers = Follow.objects.filter(
+        following_id__in=by_author,
+        following__followers_count__lte=settings.FEED_FANOUT_LIMIT,
+    ).values_list('following_id', 'user_id')
+    FeedEntry.objects.bulk_create(
+        (FeedEntry(user_id=user_id, recipe_id=pk, created=created)
+         for author_id, user_id in followers.iterator()
+         for pk, created in by_author[author_id]),
+        batch_size=1000,
+        ignore_conflicts=True,
+    )
+
+
+def follow_authors(user_id, author_ids):
+    """Заполняет ленту последними рецептами новых авторов."""
+    add_entries((user_id,), Recipe.objects.filter(
+        author_id__in=author_ids,
+    ).order_by('-created', '-id').values_list(
+        'id', 'created')[:settings.FEED_MAX_LENGTH])
+
+
+def unfollow_authors(user_id, author_ids):
+    FeedEntry.objects.filter(
+        user_id=user_id, recipe__author_id__in=author_ids).delete()
+
+
+def pull_popular(user):
+    """Переносит в ленту новые рецепты популярных авторов из подписок.
+
+    Выбираются рецепты, опубликованные после прошлого переноса (с
+    запасом на долгие транзакции), дубли отбрасывает уникальность.
+    """
+    popular = list(User.objects.filter(
+        following__user=user,
+        followers_count__gt=settings.FEED_FANOUT_LIMIT,
+    ).values_list('pk', flat=True))
+    if not popular:
+        return
+    key = FEED_PULLED_KEY.format(user.pk)
+    pulled = cache.get(key)
+    now = timezone.now()
+    recipes = Recipe.objects.filter(author_id__in=popular)
+    if pulled is not None:
+        recipes = recipes.filter(created__gt=pulled - FEED_PULL_OVERLAP)
+    add_entries((user.pk,), recipes.order_by('-created', '-id').values_list(
+        'id', 'created')[:settings.FEED_MAX_LENGTH])
+    cache.set(key, now, None)
+
+
+def trim_feed(user):
+    """Удаляет из ленты записи старше FEED_MAX_LENGTH последних."""
+    cutoff = FeedEntry.objects.filter(user=user).order_by(
+        '-created', '-recipe_id').values_list('created', 'recipe_id')[
+        settings.FEED_MAX_LENGTH:settings.FEED_MAX_LENGTH + 1]
+    for created, recipe_id in cutoff:
+        FeedEntry.objects.filter(
+            Q(created__lt=created) | Q(created=created,
+                                       recipe_id__lte=recipe_id),
+            user=user,
+        ).delete()
+
+
+def refresh_feed(user):
+    """Готовит ленту к чтению первой страницы."""
+    pull_popular(user)
+    trim_feed(user)
@@ -0,0 +1,49 @@
+"""Уменьшенные копии изображений рецептов.
+
+Модуль не зависит от Django: render_variants выполняется в отдельном
+процессе и получает и возвращает только байты.
+"""
+from io import BytesIO
+
+from PIL import Image, ImageOps
+
+VARIANTS = {
+    'card': (480, 480),
+    'detail': (1280, 1280),
+}
+FORMATS = {
+    'webp': ('WEBP', {'quality': 80, 'method': 4}),
+    'jpeg': ('JPEG', {'quality': 82, 'optimize': True, 'progressive': True}),
+}
+BACKGROUND = (255, 255, 255)
+
+
+def flatten(image):
+    """Переводит изображение в RGB, подкладывая белый фон под прозрачность."""
+    if image.mode in ('RGBA', 'LA', 'P'):
+        image = image.convert('RGBA')
+        background = Image.new('RGB', image.size, BACKGROUND)
+        background.paste(image, mask=image.getchannel('A'))
+        return background
+    return image.convert('RGB')
+
+
+def render_variants(data):
+    """Возвращает {вариант: {формат: байты}} для исходного изображения.
+
+    Поворот из EXIF применяется к пикселям, сами метаданные (EXIF,
+    ICC-профиль, комментарии) в копии не переносятся.
+    """
+    with Image.open(BytesIO(data)) as source:
+        image = flatten(ImageOps.exif_transpose(source))
+    variants = {}
+    for variant, size in VARIANTS.items():
+        thumbnail = image.copy()
+        thumbnail.thumbnail(size, Image.Resampling.LANCZOS)
+        thumbnail.info = {}
+        variants[variant] = {}
+        for file_format, (pil_format, options) in FORMATS.items():
+            output = BytesIO()
+            thumbnail.save(output, pil_format, **options)
+            variants[variant][file_format] = output.getvalue()
+    return variants
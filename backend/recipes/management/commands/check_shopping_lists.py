@@ -0,0 +1,67 @@
+from django.contrib.auth import get_user_model
+from django.core.management.base import BaseCommand
+from django.db import transaction
+
+from recipes.models import ShoppingListItem
+from recipes.shopping_list import expected_items
+
+User = get_user_model()
+
+
+class Command(BaseCommand):
+    help = ('Сверяет списки покупок с корзинами пользователей '
+            'и при --fix исправляет расхождения.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--fix', action='store_true',
+                            help='Пересчитать списки с расхождениями.')
+        parser.add_argument('--batch-size', type=int, default=500,
+                            help='Пользователей в одной пачке.')
+
+    def handle(self, *args, **options):
+        users = User.objects.order_by('pk').values_list('pk', flat=True)
+        batch_size = options['batch_size']
+        drifted = 0
+        last_pk = 0
+        while True:
+            user_ids = list(users.filter(pk__gt=last_pk)[:batch_size])
+            if not user_ids:
+                break
+            last_pk = user_ids[-1]
+            drifted += self.check_batch(user_ids, options['fix'])
+        message = f'Списков с расхождениями: {drifted}.'
+        if drifted and not options['fix']:
+            self.stdout.write(self.style.WARNING(message))
+        else:
+            self.stdout.write(self.style.SUCCESS(message))
+
+    def check_batch(self, user_ids, fix):
+        expected = {
+            (user_id, ingredient_id): amount
+            for user_id, ingredient_id, amount in expected_items(user_ids)
+        }
+        actual = {
+            (user_id, ingredient_id): amount
+            for user_id, ingredient_id, amount
+            in ShoppingListItem.objects.filter(user_id__in=user_ids)
+            .values_list('user_id', 'ingredient_id', 'amount')
+        }
+        drifted = {
+            key[0] for key in expected.keys() | actual.keys()
+            if expected.get(key) != actual.get(key)
+        }
+        for user_id in sorted(drifted):
+            self.stdout.write(f'Расхождение у пользователя id={user_id}')
+        if fix and drifted:
+            with transaction.atomic():
+                ShoppingListItem.objects.filter(user_id__in=drifted).delete()
+                ShoppingListItem.objects.bulk_create(
+                    ShoppingListItem(
+                        user_id=user_id,
+                        ingredient_id=ingredient_id,
+                        amount=amount,
+                    )
+                    for (user_id, ingredient_id), amount in expected.items()
+                    if user_id in drifted
+                )
+        return len(drifted)
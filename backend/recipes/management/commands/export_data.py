@@ -0,0 +1,26 @@
+from django.core.management.base import BaseCommand
+
+from recipes.export import SECTIONS, export_lines
+
+
+class Command(BaseCommand):
+    help = ('Выгружает рецепты с тегами и ингредиентами, избранное, '
+            'корзины и подписки в NDJSON.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--output',
+                            help='Файл выгрузки, по умолчанию stdout.')
+        parser.add_argument('--sections', nargs='+', choices=SECTIONS,
+                            default=list(SECTIONS),
+                            help='Выгружаемые разделы.')
+        parser.add_argument('--chunk-size', type=int,
+                            help='Строк в одной выборке курсора.')
+
+    def handle(self, *args, **options):
+        lines = export_lines(options['sections'], options['chunk_size'])
+        if options['output'] is None:
+            for line in lines:
+                self.stdout.write(line, ending='')
+            return
+        with open(options['output'], 'w', encoding='utf-8') as output:
+            output.writelines(lines)
@@ -0,0 +1,79 @@
+import os
+from datetime import timedelta
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.utils import timezone
+
+from recipes.models import ImageUpload, Recipe
+
+DIRECTORIES = ('recipes/images', 'recipes/variants')
+
+
+class Command(BaseCommand):
+    help = ('Удаляет файлы изображений, на которые не ссылается '
+            'ни один рецепт, и незавершенные загрузки старше '
+            'UPLOAD_EXPIRY_HOURS.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--dry-run', action='store_true',
+                            help='Только показать, что будет удалено.')
+        parser.add_argument('--min-age', type=int, default=60 * 60,
+                            help='Не трогать файлы моложе стольких секунд.')
+
+    def handle(self, *args, **options):
+        storage = Recipe._meta.get_field('image').storage
+        references = self.count_references()
+        threshold = timezone.now() - timedelta(seconds=options['min_age'])
+        removed = freed = 0
+        for name in self.walk(storage):
+            if references.get(name):
+                continue
+            if storage.get_modified_time(name) > threshold:
+                continue
+            size = storage.size(name)
+            self.stdout.write(f'{name} ({size} байт)')
+            if not options['dry_run']:
+                storage.delete(name)
+            removed += 1
+            freed += size
+        self.stdout.write(self.style.SUCCESS(
+            f'Файлов без ссылок: {removed}, {freed} байт, '
+            f'файлов со ссылками: {len(references)}.'))
+        self.expire_uploads(options['dry_run'])
+
+    def expire_uploads(self, dry_run):
+        expired = ImageUpload.objects.filter(created__lt=timezone.now() - (
+            timedelta(hours=settings.UPLOAD_EXPIRY_HOURS)))
+        count = 0
+        for upload in expired.iterator():
+            if not dry_run:
+                upload.discard()
+            count += 1
+        self.stdout.write(self.style.SUCCESS(
+            f'Просроченных загрузок: {count}.'))
+
+    def count_references(self):
+        """Число ссылок из рецептов на каждый файл."""
+        references = {}
+        for image, variants in Recipe.objects.values_list(
+                'image', 'image_variants').iterator():
+            names = [image] + [
+                name for files in variants.values() if isinstance(files, dict)
+                for name in files.values()
+            ]
+            for name in names:
+                if name:
+                    references[name] = references.get(name, 0) + 1
+        return references
+
+    def walk(self, storage):
+        stack = [directory for directory in DIRECTORIES
+                 if storage.exists(directory)]
+        while stack:
+            directory = stack.pop()
+            directories, files = storage.listdir(directory)
+            stack.extend(os.path.join(directory, name).replace('\\', '/')
+                         for name in directories)
+            for name in files:
+                yield os.path.join(directory, name).replace('\\', '/')
@@ -0,0 +1,54 @@
+from django.core.management.base import BaseCommand
+
+from recipes.counters import COUNTERS, actual_counts
+
+
+class Command(BaseCommand):
+    help = ('Пересчитывает счетчики рецептов, избранного и подписчиков '
+            'и сообщает о расхождениях.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--dry-run', action='store_true',
+                            help='Только сообщить о расхождениях.')
+        parser.add_argument('--batch-size', type=int, default=1000,
+                            help='Объектов в одной пачке.')
+
+    def handle(self, *args, **options):
+        for model, counters in COUNTERS.items():
+            drifted = self.recount(
+                model, counters, options['batch_size'], options['dry_run'])
+            message = (f'{model._meta.verbose_name_plural}: '
+                       f'расхождений {drifted}.')
+            if drifted and options['dry_run']:
+                self.stdout.write(self.style.WARNING(message))
+            else:
+                self.stdout.write(self.style.SUCCESS(message))
+
+    def recount(self, model, counters, batch_size, dry_run):
+        fields = tuple(counters)
+        objects = model.objects.order_by('pk').annotate(
+            **{f'actual_{field}': value
+               for field, value in actual_counts(model).items()}
+        ).values_list('pk', *fields, *(f'actual_{field}' for field in fields))
+        drifted = 0
+        last_pk = 0
+        while True:
+            rows = list(objects.filter(pk__gt=last_pk)[:batch_size])
+            if not rows:
+                break
+            last_pk = rows[-1][0]
+            drifted_ids = []
+            for pk, *values in rows:
+                stored = dict(zip(fields, values[:len(fields)]))
+                actual = dict(zip(fields, values[len(fields):]))
+                if stored != actual:
+                    drifted_ids.append(pk)
+                    self.stdout.write(
+                        f'{model._meta.verbose_name} id={pk}: '
+                        f'{stored} вместо {actual}')
+            if drifted_ids and not dry_run:
+                # Пересчет в самом UPDATE не теряет параллельных приращений.
+                model.objects.filter(pk__in=drifted_ids).update(
+                    **actual_counts(model))
+            drifted += len(drifted_ids)
+        return drifted
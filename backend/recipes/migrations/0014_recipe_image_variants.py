@@ -0,0 +1,18 @@
+# Generated by Django 3.2.23 on 2026-10-16 23:01
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('recipes', '0013_feedentry'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='recipe',
+            name='image_variants',
+            field=models.JSONField(default=dict, editable=False, help_text='Заполняется после обработки изображения.', verbose_name='Уменьшенные копии фото'),
+        ),
+    ]
@@ -0,0 +1,19 @@
+# Generated by Django 3.2.23 on 2026-10-16 23:02
+
+from django.db import migrations, models
+import recipes.storage
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('recipes', '0014_recipe_image_variants'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='recipe',
+            name='image',
+            field=models.ImageField(storage=recipes.storage.get_image_storage, upload_to='recipes/images/', verbose_name='Фото'),
+        ),
+    ]
@@ -0,0 +1,51 @@
+# Generated by Django 3.2.23 on 2026-10-16 23:06
+
+import hashlib
+
+from django.db import migrations, models
+
+
+def recipe_digest(name, text):
+    """Копия recipes.models.recipe_digest на момент миграции."""
+    normalized = '\n'.join(
+        ' '.join(value.split()).casefold() for value in (name, text))
+    return hashlib.sha256(normalized.encode()).hexdigest()
+
+
+def fill_digests(apps, schema_editor):
+    """Заполняет хеши, у уже существующих дублей хеш остается пустым."""
+    Recipe = apps.get_model('recipes', 'Recipe')
+    seen = set()
+    batch = []
+    for recipe in Recipe.objects.only(
+            'author_id', 'name', 'text').order_by('pk').iterator():
+        digest = recipe_digest(recipe.name, recipe.text)
+        if (recipe.author_id, digest) in seen:
+            continue
+        seen.add((recipe.author_id, digest))
+        recipe.digest = digest
+        batch.append(recipe)
+        if len(batch) >= 1000:
+            Recipe.objects.bulk_update(batch, ('digest',))
+            batch = []
+    Recipe.objects.bulk_update(batch, ('digest',))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('recipes', '0016_imageupload'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='recipe',
+            name='digest',
+            field=models.CharField(editable=False, max_length=64, null=True, verbose_name='Хеш названия и описания'),
+        ),
+        migrations.RunPython(fill_digests, migrations.RunPython.noop),
+        migrations.AddConstraint(
+            model_name='recipe',
+            constraint=models.UniqueConstraint(fields=('author', 'digest'), name='unique_recipe_digest'),
+        ),
+    ]
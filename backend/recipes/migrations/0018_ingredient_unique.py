@@ -0,0 +1,43 @@
+# Generated by Django 3.2.23 on 2026-10-16 23:08
+
+from django.db import migrations, models
+from django.db.models import Count, Min
+
+
+def merge_duplicates(apps, schema_editor):
+    """Переносит ссылки на дубли ингредиента на его первую запись."""
+    Ingredient = apps.get_model('recipes', 'Ingredient')
+    IngredientInRecipe = apps.get_model('recipes', 'IngredientInRecipe')
+    ShoppingListItem = apps.get_model('recipes', 'ShoppingListItem')
+    groups = Ingredient.objects.values('name', 'measurement_unit').annotate(
+        first=Min('id'), total=Count('id')).filter(total__gt=1)
+    for group in groups:
+        duplicates = list(Ingredient.objects.filter(
+            name=group['name'], measurement_unit=group['measurement_unit'],
+        ).exclude(pk=group['first']).values_list('pk', flat=True))
+        IngredientInRecipe.objects.filter(
+            ingredient_id__in=duplicates).update(ingredient_id=group['first'])
+        for item in ShoppingListItem.objects.filter(
+                ingredient_id__in=duplicates):
+            kept, _ = ShoppingListItem.objects.get_or_create(
+                user_id=item.user_id, ingredient_id=group['first'],
+                defaults={'amount': 0})
+            kept.amount += item.amount
+            kept.save(update_fields=('amount',))
+            item.delete()
+        Ingredient.objects.filter(pk__in=duplicates).delete()
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('recipes', '0017_recipe_digest'),
+    ]
+
+    operations = [
+        migrations.RunPython(merge_duplicates, migrations.RunPython.noop),
+        migrations.AddConstraint(
+            model_name='ingredient',
+            constraint=models.UniqueConstraint(fields=('name', 'measurement_unit'), name='unique_ingredient'),
+        ),
+    ]
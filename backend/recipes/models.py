@@ -1,10 +1,26 @@
+import hashlib
+import os
+import uuid
+
+from django.conf import settings
 from django.db import models
 from django.contrib.auth import get_user_model
+from django.contrib.postgres.search import SearchVectorField
+
+from users.models import CounterFieldsModel
+from .storage import get_image_storage
 
 
 User = get_user_model()
 
 
+def recipe_digest(name, text):
+    """SHA-256 названия и описания без учета регистра и пробелов."""
+    normalized = '\n'.join(
+        ' '.join(value.split()).casefold() for value in (name, text))
+    return hashlib.sha256(normalized.encode()).hexdigest()
+
+
 class Tag(models.Model):
     name = models.CharField('Тег', max_length=20)
     color = models.CharField('Цвет тега', max_length=16)
@@ -31,12 +47,17 @@ class Ingredient(models.Model):
     class Meta:
         verbose_name = 'Ингредиент'
         verbose_name_plural = 'Ингредиенты'
+        constraints = [
+            models.UniqueConstraint(
+                fields=('name', 'measurement_unit'),
+                name='unique_ingredient',
+            )]
 
     def __str__(self):
         return f'{self.name}({self.measurement_unit})'
 
 
-class Recipe(models.Model):
+class Recipe(CounterFieldsModel):
     author = models.ForeignKey(
         User,
         verbose_name='Автор',
@@ -66,22 +87,68 @@ class Recipe(models.Model):
     image = models.ImageField(
         verbose_name='Фото',
         upload_to='recipes/images/',
+        storage=get_image_storage,
     )
     created = models.DateTimeField(
         'Дата добавления',
         auto_now_add=True,
         db_index=True
     )
+    updated = models.DateTimeField(
+        'Дата изменения',
+        auto_now=True,
+        db_index=True
+    )
+    search_vector = SearchVectorField(
+        'Поисковый вектор',
+        null=True,
+        editable=False,
+        help_text='Заполняется триггером PostgreSQL по названию и описанию.'
+    )
+    image_variants = models.JSONField(
+        'Уменьшенные копии фото',
+        default=dict,
+        editable=False,
+        help_text='Заполняется после обработки изображения.'
+    )
+    favorites_count = models.PositiveIntegerField(
+        'Добавлено в избранное',
+        default=0,
+        editable=False,
+    )
+
+    digest = models.CharField(
+        'Хеш названия и описания',
+        max_length=64,
+        null=True,
+        editable=False,
+    )
+
+    counter_fields = ('favorites_count',)
 
     class Meta:
         default_related_name = 'recipes'
         verbose_name = 'Рецепт'
         verbose_name_plural = 'Рецепты'
         ordering = ('-created',)
+        constraints = [
+            models.UniqueConstraint(
+                fields=('author', 'digest'),
+                name='unique_recipe_digest',
+            ),
+        ]
 
     def __str__(self):
         return self.name
 
+    def save(self, *args, **kwargs):
+        self.digest = recipe_digest(self.name, self.text)
+        update_fields = kwargs.get('update_fields')
+        if update_fields is not None and {'name', 'text'} & set(
+                update_fields):
+            kwargs['update_fields'] = {*update_fields, 'digest'}
+        super().save(*args, **kwargs)
+
 
 class IngredientInRecipe(models.Model):
     ingredient = models.ForeignKey(
@@ -146,3 +213,124 @@ class ShopingCart(UserRecipeModel):
             models.UniqueConstraint(
                 fields=('recipe', 'user'), name='unique_shopping_cart',
             )]
+
+
+class ShoppingListItem(models.Model):
+    """Сумма ингредиента по всем рецептам в списке покупок пользователя.
+
+    Поддерживается приращениями при изменении списка покупок и рецептов,
+    расхождения находит команда check_shopping_lists.
+    """
+
+    user = models.ForeignKey(
+        User,
+        on_delete=models.CASCADE,
+        verbose_name='Пользователь',
+        related_name='shopping_list',
+    )
+    ingredient = models.ForeignKey(
+        Ingredient,
+        on_delete=models.CASCADE,
+        verbose_name='Ингредиент',
+    )
+    amount = models.IntegerField('Количество')
+
+    class Meta:
+        verbose_name = 'ингредиент в списке покупок'
+        verbose_name_plural = 'Ингредиенты в списке покупок'
+        constraints = [
+            models.UniqueConstraint(
+                fields=('user', 'ingredient'),
+                name='unique_shopping_list_item',
+            )]
+
+    def __str__(self):
+        return f'{self.ingredient} - {self.amount}'
+
+
+class FeedEntry(models.Model):
+    """Рецепт в ленте подписчика автора.
+
+    Записи добавляются при публикации рецепта (рецепты популярных
+    авторов переносятся при чтении ленты) и при подписке, длина ленты
+    ограничена FEED_MAX_LENGTH.
+    """
+
+    user = models.ForeignKey(
+        User,
+        on_delete=models.CASCADE,
+        verbose_name='Пользователь',
+        related_name='feed',
+    )
+    recipe = models.ForeignKey(
+        Recipe,
+        on_delete=models.CASCADE,
+        verbose_name='Рецепт',
+        related_name='feed_entries',
+    )
+    created = models.DateTimeField('Дата добавления рецепта')
+
+    class Meta:
+        verbose_name = 'рецепт в ленте'
+        verbose_name_plural = 'Рецепты в лентах'
+        constraints = [
+            models.UniqueConstraint(
+                fields=('user', 'recipe'), name='unique_feed_entry',
+            )]
+        indexes = [
+            models.Index(
+                fields=('user', '-created', '-recipe'),
+                name='feed_entry_user_created',
+            )]
+
+    def __str__(self):
+        return f'{self.user} - {self.recipe}'
+
+
+class ImageUpload(models.Model):
+    """Изображение, загружаемое частями.
+
+    Части дописываются во временный файл, число принятых байт равно
+    его размеру. Готовую загрузку рецепт указывает как upload:<token>.
+    """
+
+    token = models.UUIDField(
+        'Токен', primary_key=True, default=uuid.uuid4, editable=False)
+    user = models.ForeignKey(
+        User,
+        on_delete=models.CASCADE,
+        verbose_name='Пользователь',
+        related_name='image_uploads',
+    )
+    filename = models.CharField('Имя файла', max_length=100)
+    size = models.PositiveIntegerField('Размер')
+    created = models.DateTimeField('Дата начала', auto_now_add=True)
+
+    class Meta:
+        verbose_name = 'загрузка изображения'
+        verbose_name_plural = 'Загрузки изображений'
+
+    def __str__(self):
+        return f'{self.filename} ({self.user})'
+
+    @property
+    def path(self):
+        return os.path.join(settings.UPLOAD_TEMP_DIR, f'{self.token}.part')
+
+    @property
+    def received(self):
+        try:
+            return os.path.getsize(self.path)
+        except FileNotFoundError:
+            return 0
+
+    @property
+    def complete(self):
+        return self.received == self.size
+
+    def discard(self):
+        try:
+            os.remove(self.path)
+        except FileNotFoundError:
+            pass
+        self.delete()
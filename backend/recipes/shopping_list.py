@@ -0,0 +1,70 @@
+"""Поддержка таблицы ShoppingListItem приращениями.
+
+Каждая функция меняет строки списка покупок одним-двумя запросами
+независимо от числа затронутых пользователей.
+"""
+from collections import Counter
+
+from django.db.models import Case, F, IntegerField, Sum, Value, When
+
+from .models import IngredientInRecipe, ShopingCart, ShoppingListItem
+
+
+def recipe_amounts(recipe_ids):
+    """Суммы ингредиентов по рецептам: {ingredient_id: amount}."""
+    return Counter(dict(
+        IngredientInRecipe.objects.filter(recipe_id__in=recipe_ids)
+        .values_list('ingredient_id').annotate(Sum('amount')).order_by()
+    ))
+
+
+def apply_deltas(user_ids, deltas):
+    """Прибавляет deltas {ingredient_id: delta} к спискам пользователей."""
+    deltas = {pk: delta for pk, delta in deltas.items() if delta}
+    if not deltas:
+        return
+    user_ids = list(user_ids)
+    if not user_ids:
+        return
+    added = [pk for pk, delta in deltas.items() if delta > 0]
+    if added:
+        ShoppingListItem.objects.bulk_create(
+            [ShoppingListItem(user_id=user_id, ingredient_id=pk, amount=0)
+             for user_id in user_ids for pk in added],
+            ignore_conflicts=True,
+        )
+    items = ShoppingListItem.objects.filter(
+        user_id__in=user_ids, ingredient_id__in=deltas)
+    items.update(amount=F('amount') + Case(
+        *(When(ingredient_id=pk, then=Value(delta))
+          for pk, delta in deltas.items()),
+        output_field=IntegerField(),
+    ))
+    if len(added) < len(deltas):
+        items.filter(amount__lte=0).delete()
+
+
+def add_recipes(user_id, recipe_ids):
+    apply_deltas((user_id,), recipe_amounts(recipe_ids))
+
+
+def remove_recipes(user_id, recipe_ids):
+    apply_deltas((user_id,), {
+        pk: -amount for pk, amount in recipe_amounts(recipe_ids).items()})
+
+
+def change_recipe(recipe, deltas):
+    """Переносит изменение ингредиентов рецепта в списки покупок."""
+    apply_deltas(
+        ShopingCart.objects.filter(recipe=recipe).values_list(
+            'user_id', flat=True),
+        deltas,
+    )
+
+
+def expected_items(user_ids):
+    """Списки покупок, посчитанные заново по корзинам пользователей."""
+    return IngredientInRecipe.objects.filter(
+        recipe__shopingcart__user__in=user_ids).values_list(
+        'recipe__shopingcart__user', 'ingredient').annotate(
+        Sum('amount')).order_by()
@@ -0,0 +1,62 @@
+"""Хранилище изображений с адресацией по содержимому.
+
+Файл сохраняется под именем из SHA-256 его содержимого, поэтому
+одинаковые изображения хранятся один раз, а содержимое файла по
+имени никогда не меняется и его можно кэшировать бессрочно. Файлы
+без ссылок из рецептов удаляет команда gc_images.
+"""
+import hashlib
+import os
+import tempfile
+
+from django.core.files.storage import FileSystemStorage
+
+
+class ContentAddressedStorage(FileSystemStorage):
+
+    def hashed_name(self, name, digest):
+        directory = os.path.dirname(name)
+        ext = os.path.splitext(name)[1].lower()
+        return os.path.join(directory, digest[:2], f'{digest}{ext}')
+
+    def get_available_name(self, name, max_length=None):
+        """Имя определит содержимое, подбирать свободное не нужно."""
+        return name
+
+    def _save(self, name, content):
+        directory = self.path(os.path.dirname(name))
+        os.makedirs(directory, exist_ok=True)
+        digest = hashlib.sha256()
+        handle, temp_path = tempfile.mkstemp(dir=directory, suffix='.tmp')
+        try:
+            with os.fdopen(handle, 'wb') as temp_file:
+                for chunk in content.chunks():
+                    digest.update(chunk)
+                    temp_file.write(chunk)
+            name = self.hashed_name(name, digest.hexdigest())
+            if self.exists(name):
+                # Свежая дата защищает файл от gc_images, пока на него
+                # еще не сослался рецепт.
+                os.remove(temp_path)
+                os.utime(self.path(name))
+                return name.replace('\\', '/')
+            os.makedirs(os.path.dirname(self.path(name)), exist_ok=True)
+            if self.file_permissions_mode is not None:
+                os.chmod(temp_path, self.file_permissions_mode)
+            else:
+                umask = os.umask(0)
+                os.umask(umask)
+                os.chmod(temp_path, 0o666 & ~umask)
+            os.replace(temp_path, self.path(name))
+        except BaseException:
+            if os.path.exists(temp_path):
+                os.remove(temp_path)
+            raise
+        return name.replace('\\', '/')
+
+
+image_storage = ContentAddressedStorage()
+
+
+def get_image_storage():
+    return image_storage
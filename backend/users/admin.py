@@ -24,6 +24,11 @@ class FollowInline(admin.TabularInline):
 @admin.register(User)
 class UserAdmin(DjangoUserAdmin):
     model = User
+    list_display = (
+        *DjangoUserAdmin.list_display,
+        'recipes_count',
+        'followers_count',
+    )
     list_filter = (
         'username',
         'email',
@@ -2,7 +2,30 @@ from django.contrib.auth.models import AbstractUser
 from django.db import models
 
 
-class CustomUser(AbstractUser):
+class CounterFieldsModel(models.Model):
+    """Модель со счетчиками, которые меняются только запросами с F().
+
+    Обычное сохранение существующего объекта не записывает счетчики,
+    чтобы не затереть их значениями, прочитанными раньше.
+    """
+
+    counter_fields = ()
+
+    class Meta:
+        abstract = True
+
+    def save(self, *args, **kwargs):
+        if (not self._state.adding and kwargs.get('update_fields') is None
+                and not kwargs.get('force_insert')):
+            kwargs['update_fields'] = [
+                field.name for field in self._meta.concrete_fields
+                if not field.primary_key
+                and field.name not in self.counter_fields
+            ]
+        super().save(*args, **kwargs)
+
+
+class CustomUser(CounterFieldsModel, AbstractUser):
 
     email = models.EmailField(
         verbose_name='Электронная почта',
@@ -20,6 +43,18 @@ class CustomUser(AbstractUser):
     password = models.CharField(
         verbose_name='Пароль',
         max_length=150)
+    recipes_count = models.PositiveIntegerField(
+        'Число рецептов',
+        default=0,
+        editable=False,
+    )
+    followers_count = models.PositiveIntegerField(
+        'Число подписчиков',
+        default=0,
+        editable=False,
+    )
+
+    counter_fields = ('recipes_count', 'followers_count')
 
     USERNAME_FIELD = 'email'
     REQUIRED_FIELDS = ('password', 'username', 'first_name', 'last_name')